@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# alu.py
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+# ALU micro-benchmark: for each instruction below this script generates
+# a MIPS program whose inner loop runs BODY copies of it and reports
+# the time per instruction under one or more copies of pymips (less
+# the time of the same loop with an empty body); fusion is disabled so
+# that each instruction runs as its own operation, e.g.:
+#
+#  $ git show HEAD~1:pymips.py > /tmp/before.py
+#  $ python bench/alu.py /tmp/before.py pymips.py
+
+ITERATIONS = 20000
+BODY = 16
+INSTRS = ["add $t0, $t1, $t2",
+          "addi $t0, $t1, -5",
+          "sub $t0, $t1, $t2",
+          "mul $t0, $t1, $t2",
+          "mult $t1, $t2",
+          "div $t1, $t2",
+          "andi $t0, $t1, 255",
+          "xori $t0, $t1, -1",
+          "sra $t0, $t2, 3",
+          "srl $t0, $t2, 3",
+          "slt $t0, $t1, $t2",
+          "sltiu $t0, $t1, 100",
+          "beq $t1, $t2, done"]
+
+def generate(instr,iterations):
+    lines = ["    .text",
+             "    li $s0, {0}".format(iterations),
+             "    li $t1, 123456789",
+             "    li $t2, -98765",
+             "loop:"]
+    if instr:
+        lines += ["    " + instr] * BODY
+    lines += ["    addi $s0, $s0, -1",
+              "    bgtz $s0, loop",
+              "done:",
+              "    li $a0, 0",
+              "    li $v0, 10",
+              "    syscall"]
+    return "\n".join(lines) + "\n"
+
+def run(pymips,instr):
+    # assemble first so that only the simulation is timed
+    fd, source = tempfile.mkstemp(suffix='.s')
+    with os.fdopen(fd,'w') as f:
+        f.write(generate(instr,ITERATIONS))
+    exe = source + ".mips"
+    try:
+        subprocess.check_call([sys.executable,pymips,'-a','-o',exe,source])
+        start = time.time()
+        subprocess.check_call([sys.executable,pymips,'--no-fusion',exe])
+        return time.time() - start
+    finally:
+        for name in (source,exe):
+            if os.path.exists(name):
+                os.remove(name)
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(os.path.dirname(__file__),'..','pymips.py')]
+    for path in paths:
+        empty = run(path,None)
+        total = 0
+        for instr in INSTRS:
+            per = (run(path,instr) - empty) / (ITERATIONS * BODY)
+            total += per
+            print("{0}: {1}: {2:.0f}ns".format(path,instr.split()[0],per * 1e9))
+        print("{0}: mean: {1:.0f}ns per instruction".format(path,total / len(INSTRS) * 1e9))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# assembler.py
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+# Assembler benchmark: this script generates a large MIPS source file
+# (by default 1,000,000 lines) resembling compiler output, i.e. lots of
+# labels, comments and instructions plus a data segment, and times how
+# long one or more copies of pymips take to assemble it, e.g.:
+#
+#  $ git show HEAD~1:pymips.py > /tmp/before.py
+#  $ python bench/assembler.py /tmp/before.py pymips.py
+#
+# The number of lines may be given with -n.
+
+LINES = 1000000
+BLOCK = ["    # basic block {0}",
+         "L{0}:",
+         "    lw $t0, 4($sp)",
+         "    addiu $t1, $t0, {0}",
+         "    sw $t1, 8($sp)     # spill",
+         "",
+         "    beq $t1, $zero, L{0}",
+         "    .word {0}, 1, 2, 3",
+         "W{0}: .asciiz \"block {0}\\n\""]
+
+def generate(lines):
+    out = ["    .text",
+           "    .globl main",
+           "main:"]
+    data = ["    .data"]
+    i = 0
+    while len(out) + len(data) < lines:
+        out += [s.format(i) for s in BLOCK[:7]]
+        data += [s.format(i) for s in BLOCK[7:]]
+        i += 1
+    out += ["    li $v0, 10",
+            "    syscall"]
+    return "\n".join(out + data) + "\n"
+
+def run(pymips,source):
+    exe = source + ".mips"
+    start = time.time()
+    subprocess.check_call([sys.executable,pymips,'-a','-o',exe,source])
+    return time.time() - start
+
+def main():
+    argv = sys.argv[1:]
+    lines = LINES
+    if argv[:1] == ['-n']:
+        lines = int(argv[1])
+        argv = argv[2:]
+    paths = argv or [os.path.join(os.path.dirname(__file__),'..','pymips.py')]
+    fd, source = tempfile.mkstemp(suffix='.s')
+    with os.fdopen(fd,'w') as f:
+        f.write(generate(lines))
+    try:
+        size = os.path.getsize(source)
+        for path in paths:
+            elapsed = run(path,source)
+            print("{0}: {1:.3f}s, {2:.0f} lines/s, {3:.2f} MB/s".format(
+                path,elapsed,lines / elapsed,size / elapsed / (1 << 20)))
+    finally:
+        for name in (source,source + ".mips"):
+            if os.path.exists(name):
+                os.remove(name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# registers.py
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+# Register micro-benchmark: this script generates a MIPS program whose
+# inner loop does nothing but register-to-register arithmetic and
+# times it under one or more copies of pymips; this makes it possible
+# to compare register file implementations between revisions, e.g.:
+#
+#  $ git show HEAD~1:pymips.py > /tmp/before.py
+#  $ python bench/registers.py /tmp/before.py pymips.py
+#
+# Each loop iteration executes BODY register instructions (three
+# register accesses each) plus the loop counter update and branch.
+
+ITERATIONS = 20000
+BODY = 16
+REGS = ['$t0','$t1','$t2','$t3','$t4','$t5','$t6','$t7']
+OPS = ['addu','xor','or','subu']
+
+def generate(iterations):
+    lines = ["    .text",
+             "    li $s0, {0}".format(iterations)]
+    for i, reg in enumerate(REGS):
+        lines.append("    li {0}, {1}".format(reg,i+1))
+    lines.append("loop:")
+    for i in range(BODY):
+        d = REGS[i % len(REGS)]
+        s = REGS[(i+3) % len(REGS)]
+        t = REGS[(i+5) % len(REGS)]
+        lines.append("    {0} {1}, {2}, {3}".format(OPS[i % len(OPS)],d,s,t))
+    lines += ["    addi $s0, $s0, -1",
+              "    bgtz $s0, loop",
+              "    li $a0, 0",
+              "    li $v0, 10",
+              "    syscall"]
+    return "\n".join(lines) + "\n"
+
+def run(pymips,source):
+    # assemble first so that only the simulation is timed
+    exe = source + ".mips"
+    subprocess.check_call([sys.executable,pymips,'-a','-o',exe,source])
+    start = time.time()
+    subprocess.check_call([sys.executable,pymips,exe])
+    return time.time() - start
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(os.path.dirname(__file__),'..','pymips.py')]
+    fd, source = tempfile.mkstemp(suffix='.s')
+    with os.fdopen(fd,'w') as f:
+        f.write(generate(ITERATIONS))
+    try:
+        instrs = ITERATIONS * (BODY + 2)
+        accesses = ITERATIONS * (BODY * 3 + 2)
+        for path in paths:
+            elapsed = run(path,source)
+            print("{0}: {1:.3f}s, {2:.0f} instr/s, {3:.0f} register accesses/s".format(
+                path,elapsed,instrs / elapsed,accesses / elapsed))
+    finally:
+        for name in (source,source + ".mips"):
+            if os.path.exists(name):
+                os.remove(name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# snapshot.py
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+# Snapshot benchmark: this script generates a MIPS program that does a
+# fair amount of input-independent setup (a sieve of Eratosthenes)
+# before it reads a number and reports whether it is prime; it then
+# runs the program against many inputs with '--batch', once resuming
+# each case from a snapshot taken at the first input system call and
+# once running each case from the start, e.g.:
+#
+#  $ python bench/snapshot.py pymips.py
+
+LIMIT = 20000
+CASES = 200
+
+SOURCE = """
+    .data
+sieve: .space {limit}
+prompt: .asciiz "n? "
+yes: .asciiz "prime\\n"
+no: .asciiz "not prime\\n"
+    .text
+main:
+    li $t9, {limit}
+    la $t7, sieve
+    li $t0, 2
+outer:
+    slt $t8, $t0, $t9
+    beq $t8, $zero, done
+    add $t6, $t7, $t0
+    lb $t1, 0($t6)
+    bne $t1, $zero, next
+    add $t2, $t0, $t0
+    li $t3, 1
+inner:
+    slt $t8, $t2, $t9
+    beq $t8, $zero, next
+    add $t6, $t7, $t2
+    sb $t3, 0($t6)
+    add $t2, $t2, $t0
+    j inner
+next:
+    addi $t0, $t0, 1
+    j outer
+done:
+    la $a0, prompt
+    li $v0, 4
+    syscall
+    li $v0, 5
+    syscall
+    add $t6, $t7, $v0
+    lb $t1, 0($t6)
+    la $a0, yes
+    beq $t1, $zero, print
+    la $a0, no
+print:
+    li $v0, 4
+    syscall
+    li $a0, 0
+    li $v0, 10
+    syscall
+"""
+
+def isprime(n):
+    return all(n % d for d in range(2,int(n ** 0.5) + 1))
+
+def run(pymips,manifest,*flags):
+    out = subprocess.check_output([sys.executable,pymips] + list(flags) + ['--batch',manifest])
+    summary = json.loads(out)
+    assert summary['passed'] == summary['total']
+    return summary['time'], sum(c['time'] for c in summary['cases']) / summary['total']
+
+def main():
+    pymips = (sys.argv[1:] or [os.path.join(os.path.dirname(__file__),'..','pymips.py')])[0]
+    tmp = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp,'sieve.s')
+        with open(source,'w') as f:
+            f.write(SOURCE.format(limit=LIMIT))
+        subprocess.check_call([sys.executable,pymips,'-a','-o',os.path.join(tmp,'sieve.mips'),source])
+        cases = []
+        for i in range(CASES):
+            n = 2 + (i * 97) % (LIMIT - 2)
+            with open(os.path.join(tmp,'in{0}'.format(i)),'w') as f:
+                f.write("{0}\n".format(n))
+            with open(os.path.join(tmp,'out{0}'.format(i)),'w') as f:
+                f.write("n? " + ("prime\n" if isprime(n) else "not prime\n"))
+            cases.append({'program':'sieve.mips','input':'in{0}'.format(i),
+                          'expected':'out{0}'.format(i)})
+        manifest = os.path.join(tmp,'manifest.json')
+        with open(manifest,'w') as f:
+            json.dump(cases,f)
+        for name, flags in (('snapshot',()),('no snapshot',('--no-snapshot',))):
+            total, latency = run(pymips,manifest,*flags)
+            print("{0}: {1} cases in {2:.3f}s, {3:.2f}ms per case".format(
+                name,CASES,total,latency * 1000))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,30 @@
 import re
 import io
 import os
-import ctypes
+import json
 import struct
+import array
 import pickle
+import mmap
+import marshal
+import errno
+import hashlib
+import imp
+import time
+import bisect
+import collections
+import weakref
+import itertools
+import functools
 import argparse
+import multiprocessing
+import asyncore
+import socket
 from sys import exit
 from sys import stdin
 from sys import stdout
 from sys import stderr
+from sys import byteorder
 
 # MIPS Simulator: this program implements a simple MIPS simulator that
 # both assembles and executes MIPS instructions. The simulator
@@ -111,35 +127,39 @@ from sys import stderr
 #  syscall           |                            | initiate system routine
 #
 
-# error reporting helper function
-def runtime_error(msg):
+# error reporting helper function: report an error and end the
+# process; errors are raised as MIPSError where they happen and only
+# 'main' and the actions it runs report them this way
+def runtime_error(msg,status=1):
+    MIPSSystem.flush_all()
     stdout.flush()
     stderr.write("pymips: error: {}\n".format(msg))
-    exit(1)
+    exit(status)
 def error_on_line(msg,line):
-    stdout.flush()
-    stderr.write("pymips: error: line {0}: {1}\n".format(line,msg))
-    exit(1)
+    # an error in the source of a program; see MIPSError
+    raise MIPSError(msg,line)
 
-# instruction functions: each function performs the operations of its
-# corresponding instruction; if 'sim' is None, then the function
-# checks to make sure 'parts' is formatted correctly
+# instruction checks: each function checks that the operands of an
+# instruction ('parts', without its name) are formatted correctly and
+# converts its immediates; MIPS_INSTRUCTIONS maps each instruction to
+# its check (instructions are run by the operations they decode to,
+# see MIPS_DECODERS)
 
-def check_register_instr(parts):
+def check_register_instr(parts,**kwargs):
     # <REG> <REG> <REG>
     if len(parts) != 3 or not parts[0] in MIPS_REGISTERS or not parts[1] in MIPS_REGISTERS \
        or not parts[2] in MIPS_REGISTERS:
         return False
     return True
 
-def check_register_instr2(parts):
+def check_register_instr2(parts,**kwargs):
     # <REG> <REG>
     if len(parts) != 2 or not parts[0] in MIPS_REGISTERS or not parts[1] in MIPS_REGISTERS:
         return False
     return True
 
 REGEX_IMMED = re.compile('^-?[0-9]+$') # immediate must be an integer
-def check_immed_instr(parts):
+def check_immed_instr(parts,**kwargs):
     # <REG> <REG> <IMMED>
     if len(parts) != 3 or not parts[0] in MIPS_REGISTERS or not parts[1] in MIPS_REGISTERS \
        or not REGEX_IMMED.match(parts[2]):
@@ -158,7 +178,7 @@ def check_direct_instr(parts,**kwargs):
     # non-resolved label
     if not isinstance(parts[1],(int,long)) \
        and not REGEX_IMMED.match(parts[1]):
-        runtime_error("line {1}: cannot resolve label '{0}'".format(parts[1],kwargs['line']))
+        error_on_line("cannot resolve label '{0}'".format(parts[1]),kwargs['line'])
     # convert immediate string to integer
     parts[1] = int(parts[1])
     return True
@@ -173,7 +193,7 @@ def check_direct_instr2(parts,**kwargs):
     # non-resolved label
     if not isinstance(parts[2],(int,long)) \
        and not REGEX_IMMED.match(parts[2]):
-        runtime_error("line {1}: cannot resolve label '{0}'".format(parts[2],kwargs['line']))
+        error_on_line("cannot resolve label '{0}'".format(parts[2]),kwargs['line'])
     # convert immediate string to integer
     parts[2] = int(parts[2])
     return True
@@ -187,17 +207,18 @@ def check_jump_instr(parts,**kwargs):
     # non-resolved label
     if not isinstance(parts[0],(int,long)) \
        and not REGEX_IMMED.match(parts[0]):
-        runtime_error("line {1}: cannot resolve label '{0}'".format(parts[0],kwargs['line']))
+        error_on_line("cannot resolve label '{0}'".format(parts[0]),kwargs['line'])
     # convert immediate string to integer
     parts[0] = int(parts[0])
     return True
 
-def check_jumpreg_instr(parts):
+def check_jumpreg_instr(parts,**kwargs):
     # <REG>
     return not (len(parts) != 1 or not parts[0] in MIPS_REGISTERS)
 
 REGEX_INDIR = re.compile('(-?[0-9]+)?\((.+)\)')
-def check_indirect_instr(parts):
+REGEX_SYMBOL = re.compile('[a-zA-Z0-9_$]+$') # anything that could name a label
+def check_indirect_instr(parts,**kwargs):
     # check indirect addressing instruction format
     # <REG> <[offset](REG)>
     if not isinstance(parts[1],str):
@@ -212,503 +233,345 @@ def check_indirect_instr(parts):
     parts.append(m.group(2))
     return True
 
-def instr_add(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_int32(t+u).value)
-
-def instr_addu(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t+u).value)
-
-def instr_addi(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = sim.read_register(parts[1])
-    sim.write_register(parts[0],ctypes.c_int32(t+parts[2]).value)
-
-def instr_addiu(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = sim.read_register(parts[1])
-    sim.write_register(parts[0],ctypes.c_uint32(t + parts[2]).value)
-
-def instr_and(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],t & u)
-
-def instr_andi(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = sim.read_register(parts[1])
-    sim.write_register(parts[0],ctypes.c_uint32(t & parts[2]).value)
-
-def instr_div(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr2(parts)
-    t = sim.read_register(parts[0])
-    u = sim.read_register(parts[1])
-    sim.write_register('HI',ctypes.c_int32(t % u).value)
-    sim.write_register('LO',ctypes.c_int32(t // u).value)
-
-def instr_divu(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr2(parts)
-    t = sim.read_register(parts[0])
-    u = sim.read_register(parts[1])
-    sim.write_register('HI',ctypes.c_uint32(t % u).value)
-    sim.write_register('LO',ctypes.c_uint32(t // u).value)
-
-def instr_mul(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_int32(t * u).value)
-
-def instr_mulu(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t * u).value)
-
-def instr_mult(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr2(parts)
-    t = sim.read_register(parts[0]) * sim.read_register(parts[1])
-    sim.write_register('HI',ctypes.c_int32(t >> 32).value)
-    sim.write_register('LO',ctypes.c_int32(t).value)
-
-def instr_multu(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr2(parts)
-    t = sim.read_register(parts[0]) * sim.read_register(parts[1])
-    sim.write_register('HI',ctypes.c_uint32(t >> 32).value)
-    sim.write_register('LO',ctypes.c_uint32(t).value)
-
-def instr_nor(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(~(t | u)).value)
-
-def instr_or(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t | u).value)
-
-def instr_ori(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = sim.read_register(parts[1])
-    sim.write_register(parts[0],ctypes.c_uint32(t | parts[2]).value)
-
-def instr_rem(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts) or check_immed_instr(parts)
-    # Read operands: the right operand may be a register or an immediate.
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2]) if parts[2] in MIPS_REGISTERS else parts[2]
-    sim.write_register(parts[0],ctypes.c_uint32(t % u).value)
-
-def instr_sll(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts) or check_immed_instr(parts)
-    # the second argument is a source register and the second could be
-    # either a register or an immediate (I handle both just to make
-    # sure)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2]) if parts[2] in MIPS_REGISTERS else parts[2]
-    sim.write_register(parts[0],ctypes.c_uint32(t << u).value)
-
-def instr_sllv(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t << u).value)
-
-def instr_sra(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts) or check_immed_instr(parts)
-    # the second argument is a source register and the second could be
-    # either a register or an immediate (I handle both just to make
-    # sure)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2]) if parts[2] in MIPS_REGISTERS else parts[2]
-    # this is an arithmetic shift; this means we must preserve the
-    # sign bit; we do this by bit-and'ing the complement of either all
-    # ones or all zeros having been shifted by the same amount
-    b = -1 if t & 0x80000000 else 0
-    sim.write_register(parts[0],ctypes.c_uint32((t >> u) & ~(b >> u)).value)
-
-def instr_srav(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    b = -1 if t & 0x80000000 else 0
-    sim.write_register(parts[0],ctypes.c_uint32((t >> u) & ~(b >> u)).value)
-
-def instr_srl(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts) or check_immed_instr(parts)
-    # the second argument is a source register and the second could be
-    # either a register or an immediate (I handle both just to make
-    # sure)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2]) if parts[2] in MIPS_REGISTERS else parts[2]
-    sim.write_register(parts[0],ctypes.c_uint32(t >> u).value)
-
-def instr_srlv(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t >> u).value)
-
-def instr_sub(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_int32(t - u).value)
-
-def instr_subu(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t - u).value)
-
-def instr_xor(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = sim.read_register(parts[1])
-    u = sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(t ^ u).value)
-
-def instr_xori(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = sim.read_register(parts[1])
-    u = ctypes.c_uint32(parts[2]).value
-    sim.write_register(parts[0],ctypes.c_uint32(t ^ u).value)
-
-def instr_slt(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = ctypes.c_int32(sim.read_register(parts[1])).value
-    u = ctypes.c_int32(sim.read_register(parts[2])).value
-    sim.write_register(parts[0],int(t < u))
-
-def instr_sltu(sim,parts,**kwargs):
-    if sim is None:
-        return check_register_instr(parts)
-    t = ctypes.c_uint32(sim.read_register(parts[1])).value
-    u = ctypes.c_uint32(sim.read_register(parts[2])).value
-    sim.write_register(parts[0],int(t < u))
-
-def instr_slti(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = ctypes.c_int32(sim.read_register(parts[1])).value
-    u = ctypes.c_int32(parts[2]).value
-    sim.write_register(parts[0],int(t < u))
-
-def instr_sltiu(sim,parts,**kwargs):
-    if sim is None:
-        return check_immed_instr(parts)
-    t = ctypes.c_uint32(sim.read_register(parts[1])).value
-    u = ctypes.c_uint32(parts[2]).value
-    sim.write_register(parts[0],int(t < u))
-
-def instr_beq(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr2(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    u = ctypes.c_int32(sim.read_register(parts[1])).value
-    if t == u:
-        sim.progCounter = parts[2]
-
-def instr_bgez(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    if t >= 0:
-        sim.progCounter = parts[1]
-
-def instr_bgtz(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    if t > 0:
-        sim.progCounter = parts[1]
-
-def instr_blez(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    if t <= 0:
-        sim.progCounter = parts[1]
-
-def instr_bne(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr2(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    u = ctypes.c_int32(sim.read_register(parts[1])).value
-    if t != u:
-        sim.progCounter = parts[2]
-
-def instr_blt(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr2(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    u = ctypes.c_int32(sim.read_register(parts[1])).value
-    if t < u:
-        sim.progCounter = parts[2]
-
-def instr_bgt(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr2(parts,**kwargs)
-    t = ctypes.c_int32(sim.read_register(parts[0])).value
-    u = ctypes.c_int32(sim.read_register(parts[1])).value
-    if t > u:
-        sim.progCounter = parts[2]
-
-def instr_j(sim,parts,**kwargs):
-    if sim is None:
-        return check_jump_instr(parts,**kwargs)
-    sim.progCounter = parts[0]
-
-def instr_jal(sim,parts,**kwargs):
-    if sim is None:
-        return check_jump_instr(parts,**kwargs)
-    sim.write_register('$ra',sim.progCounter) # link
-    sim.progCounter = parts[0]
-
-def instr_jalr(sim,parts,**kwargs):
-    if sim is None:
-        return check_jumpreg_instr(parts)
-    sim.write_register('$ra',sim.progCounter) # link
-    sim.progCounter = sim.read_register(parts[0])
-
-def instr_jr(sim,parts,**kwargs):
-    if sim is None:
-        return check_jumpreg_instr(parts)
-    sim.progCounter = sim.read_register(parts[0])
-
-def instr_la(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr(parts,**kwargs) or check_indirect_instr(parts)
-    if len(parts) == 2:
-        addr = parts[1]
-    else:
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_register(parts[0],addr)
-
-def instr_lhi(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr(parts,**kwargs)
-    # grab current register value and place in upper word
-    t = (sim.read_register(parts[0]) & 0xffff) | (parts[1] << 16)
-    sim.write_register(parts[0],t)
-
-def instr_li(sim,parts,**kwargs):
-    return instr_la(sim,parts)
-
-def instr_llo(sim,parts,**kwargs):
-    if sim is None:
-        return check_direct_instr(parts,**kwargs)
-    # grab current register value and place in upper word
-    t = (sim.read_register(parts[0]) & 0xffff0000) | (parts[1] << 16)
-    sim.write_register(parts[0],t)
-
-def instr_lb(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_register(parts[0],sim.read_byte(addr))
+def check_register_or_immed_instr(parts,**kwargs):
+    # <REG> <REG> <REG> or <REG> <REG> <IMMED>
+    return check_register_instr(parts) or check_immed_instr(parts)
 
-def instr_lbu(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(sim.read_byte(addr)).value)
+def check_address_instr(parts,**kwargs):
+    # <REG> <LITERAL> or <REG> <[offset](REG)>
+    return check_direct_instr(parts,**kwargs) or check_indirect_instr(parts)
 
-def instr_lh(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_register(parts[0],sim.read_halfword(addr))
+def check_memory_instr(parts,**kwargs):
+    # <REG> <[offset](REG)> or <REG> <LITERAL>
+    return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
 
-def instr_lhu(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_register(parts[0],ctypes.c_uint32(sim.read_halfword(addr)).value)
+def check_noarg_instr(parts,**kwargs):
+    return len(parts) == 0
 
-def instr_lw(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_register(parts[0],sim.read_word(addr))
-
-def instr_mfhi(sim,parts,**kwargs):
-    if sim is None:
-        return check_jumpreg_instr(parts)
-    t = sim.read_register('HI')
-    sim.write_register(parts[0],t)
-
-def instr_mflo(sim,parts,**kwargs):
-    if sim is None:
-        return check_jumpreg_instr(parts)
-    t = sim.read_register('LO')
-    sim.write_register(parts[0],t)
-
-def instr_move(sim,parts,**kwargs):
-    if sim is None:
-        return len(parts) == 2 and parts[0] in MIPS_REGISTERS \
-            and parts[1] in MIPS_REGISTERS
-    t = sim.read_register(parts[1])
-    sim.write_register(parts[0],t)
-
-def instr_mthi(sim,parts,**kwargs):
-    if sim is None:
-        return check_jumpreg_instr(parts)
-    t = sim.read_register(parts[0])
-    sim.write_register('HI',t)
-
-def instr_mtlo(sim,parts,**kwargs):
-    if sim is None:
-        return check_jumpreg_instr(parts)
-    t = sim.read_register(parts[0])
-    sim.write_register('LO',t)
-
-def instr_sb(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_byte(addr,sim.read_register(parts[0]))
-
-def instr_sh(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_halfword(addr,sim.read_register(parts[0]))
-
-def instr_sw(sim,parts,**kwargs):
-    if sim is None:
-        return check_indirect_instr(parts) or check_direct_instr(parts,**kwargs)
-    if len(parts) == 2:
-        # direct
-        addr = parts[1]
-    else:
-        # indirect (i.e. from register)
-        addr = parts[1] + sim.read_register(parts[2])
-    sim.write_word(addr,sim.read_register(parts[0]))
-
-def instr_syscall(sim,parts,**kwargs):
-    if sim is None:
-        return len(parts) == 0
+def system_call(sim):
     # simulate the SPIM system calls
     v = sim.read_register('$v0')
     if v == 1:
         # print_int ($a0 = word to print)
 
-        system.print_int(sim.read_register('$a0'))
+        sim.system.print_int(sim.read_register('$a0'))
     elif v == 4:
         # print_string ($a0 = pointer to null-terminated buffer)
 
-        system.print_string(sim.read_string(sim.read_register('$a0')))
+        sim.system.print_string(sim.string_at(sim.read_register('$a0')))
     elif v == 5:
         # read_int
 
-        i = system.read_int()
+        i = sim.system.read_int()
         sim.write_register('$v0',i)
     elif v == 8:
         # read_string ($a0 = pointer to buffer, $a1 = amount); returns
         # number of bytes read
 
-        n = system.read_string(sim,sim.read_register('$a0'),sim.read_register('$a1'))
+        n = sim.system.read_string(sim,sim.read_register('$a0'),sim.read_register('$a1'))
         sim.write_register('$v0',n)
+    elif v == 9:
+        # sbrk ($a0 = number of bytes to allocate); returns the address
+        # of the allocated memory
+
+        sim.write_register('$v0',sim.memory.sbrk(sim.read_register('$a0')))
     elif v == 10:
         # exit ($a0 = process return code)
 
-        system.exit(sim.read_register('$a0'))
+        sim.system.exit(sim.read_register('$a0'))
     elif v == 11:
         # print_character ($a0 = char)
 
-        system.print_character(sim.read_register('$a0'))
+        sim.system.print_character(sim.read_register('$a0'))
     elif v == 12:
         # read_character
 
-        sim.write_register('$v0',system.read_character())
+        sim.write_register('$v0',sim.system.read_character())
+    elif v == 13:
+        # open ($a0 = pointer to null-terminated file name, $a1 = flags,
+        # $a2 = mode); returns a file descriptor or -1 on failure
+
+        fd = sim.system.open_file(sim.read_string(sim.read_register('$a0')),
+                                  sim.read_register('$a1'),sim.read_register('$a2'))
+        sim.write_register('$v0',fd)
+    elif v == 14:
+        # read ($a0 = file descriptor, $a1 = pointer to buffer, $a2 =
+        # amount); returns number of bytes read, 0 at the end of the
+        # file or -1 on failure
+
+        n = sim.system.read_file(sim.memory,sim.read_register('$a0'),sim.read_register('$a1'),
+                                 sim.read_register('$a2'))
+        sim.write_register('$v0',n)
+    elif v == 15:
+        # write ($a0 = file descriptor, $a1 = pointer to buffer, $a2 =
+        # amount); returns number of bytes written or -1 on failure
+
+        n = sim.system.write_file(sim.memory,sim.read_register('$a0'),sim.read_register('$a1'),
+                                  sim.read_register('$a2'))
+        sim.write_register('$v0',n)
+    elif v == 16:
+        # close ($a0 = file descriptor); returns 0 or -1 on failure
+
+        sim.write_register('$v0',sim.system.close_file(sim.read_register('$a0')))
+    else:
+        raise MIPSError("could not execute system call {0}: no such service".format(v))
+
+def format_instr(parts):
+    # format an instruction (as produced by the assembler) the way it
+    # would be written in assembly
+    args = [str(p) for p in parts[1:]]
+    if len(args) == 3 and parts[0] in EXE_INDIRECT and isinstance(parts[2],(int,long)):
+        args[1:] = ["{0}({1})".format(args[1],args[2])]
+    return "{0} {1}".format(parts[0],", ".join(args)).rstrip()
+
+# decode functions: each function turns an instruction into an
+# operation bound to a simulator; register operands ('a', 'b' and
+# 'c', in the order they appear in the instruction) are given as
+# indices into the register file and 'imm' is the immediate (or
+# resolved label) operand; missing operands are None; an operation
+# takes the offset of its instruction and returns the offset of the
+# next instruction to execute; results that may not fit in a word are
+# wrapped to a signed 32-bit value inline with integer masks
+
+def decode_operands(parts):
+    # split the operands of a checked instruction into register
+    # indices and an immediate; an instruction has at most one
+    # immediate operand
+    regs = [None,None,None]
+    imm = None
+    n = 0
+    for p in parts[1:]:
+        if isinstance(p,(int,long)):
+            imm = p
+        else:
+            regs[n] = MIPS_REGISTERS[p] >> 2
+            n += 1
+    return regs[0], regs[1], regs[2], imm
+
+def semantics(name,b):
+    # the template of an instruction that does not transfer control
+    # (see MIPS_SEMANTICS); 'la' and 'li' without a register load
+    # their immediate as is
+    if name in ('la','li') and b is None:
+        return "{a} = {imms}"
+    return MIPS_SEMANTICS[name]
+
+SEMANTICS_FACTORIES = {}
+def decode_semantics(sim,a,b,c,imm,name):
+    # the ALU kernel: operations of instructions that only compute on
+    # registers and immediates, and of conditional branches, are built
+    # from the same templates as translated blocks (see MIPSTranslator)
+    # so the two cannot disagree; the source of a factory that binds
+    # an operation to its operands is compiled once per instruction
+    # and operand form; immediates are converted when decoding; a
+    # branch without an immediate reads its target from the program
+    # (MIPSInstructions.imms) so that it does not depend on its offset
+    key = (name,b is None,c is None,imm is None)
+    make = SEMANTICS_FACTORIES.get(key)
+    if make is None:
+        fields = {'a':'r[a]','b':'r[b]','c':'r[c]' if c is not None else 'imm',
+                  'imm':'imm','imms':'imms','immu':'immu','immw':'immw',
+                  'addr':'imm' if b is None else '(imm + r[b])',
+                  'hi':'r[{0}]'.format(REG_HI),'lo':'r[{0}]'.format(REG_LO)}
+        if name in MIPS_BRANCHES:
+            body = ["if {0}:".format(MIPS_BRANCHES[name].format(**fields)),
+                    "    return imm" if imm is not None else "    return t[pc]"]
+        else:
+            body = semantics(name,b).format(**fields).split('; ')
+        source = ["def make(r,t,a,b,c,imm):"]
+        if c is None and imm is not None:
+            source += ["    imms = ((imm + 0x80000000) & 0xffffffff) - 0x80000000",
+                       "    immu = imm & 0xffffffff",
+                       "    immw = imm + 0x80000000"]
+        source += ["    def op(pc):"] + ["        " + line for line in body] + \
+                  ["        return pc + 1",
+                   "    return op"]
+        env = {}
+        exec compile("\n".join(source),"<pymips {0}>".format(name),'exec') in env
+        make = SEMANTICS_FACTORIES[key] = env['make']
+    return make(sim.registers,sim.instr.imms,a,b,c,imm)
+
+def decode_j(sim,a,b,c,imm):
+    # see decode_semantics for jumps without an immediate
+    t = sim.instr.imms
+    if imm is None:
+        def op(pc):
+            return t[pc]
+    else:
+        def op(pc):
+            return imm
+    return op
+
+def decode_jal(sim,a,b,c,imm):
+    r = sim.registers
+    t = sim.instr.imms
+    if imm is None:
+        def op(pc):
+            r[REG_RA] = pc + 1 # link
+            return t[pc]
+    else:
+        def op(pc):
+            r[REG_RA] = pc + 1 # link
+            return imm
+    return op
+
+def decode_jalr(sim,a,b,c,imm):
+    # the only instructions whose target is not known until they
+    # execute (see MIPSSimulator.decode_lazy); a negative target is
+    # a large unsigned one so one comparison checks it
+    r = sim.registers
+    n = len(sim.instr)
+    def op(pc):
+        r[REG_RA] = pc + 1 # link
+        t = r[a]
+        if t & 0xffffffff < n:
+            return t
+        sim.bad_offset(pc,t)
+    return op
+
+def decode_jr(sim,a,b,c,imm):
+    r = sim.registers
+    n = len(sim.instr)
+    def op(pc):
+        t = r[a]
+        if t & 0xffffffff < n:
+            return t
+        sim.bad_offset(pc,t)
+    return op
+
+def decode_load(sim,a,b,imm,load):
+    # shared by all load instructions; 'load' reads a value of the
+    # appropriate size from main memory
+    r = sim.registers
+    if b is None:
+        # direct
+        def op(pc):
+            r[a] = load(imm)
+            return pc + 1
+    else:
+        # indirect (i.e. from register)
+        def op(pc):
+            r[a] = load(imm + r[b])
+            return pc + 1
+    return op
+
+def decode_lb(sim,a,b,c,imm):
+    return decode_load(sim,a,b,imm,sim.read_byte)
+
+def decode_lh(sim,a,b,c,imm):
+    return decode_load(sim,a,b,imm,sim.read_halfword)
+
+def decode_lw(sim,a,b,c,imm):
+    # word loads are common enough (stack frames) that the op looks up
+    # the page itself and only calls the memory object when the access
+    # is not within one allocated page
+    r = sim.registers
+    get = sim.memory.pages.get
+    unpack = STRUCT_WORD.unpack_from
+    load = sim.read_word
+    shift, mask, last = PAGE_SHIFT, PAGE_MASK, PAGE_SIZE - 4
+    if b is None:
+        return decode_load(sim,a,b,imm,load)
+    def op(pc):
+        addr = imm + r[b]
+        page = get(addr >> shift)
+        off = addr & mask
+        if page is None or off > last:
+            r[a] = load(addr)
+        else:
+            r[a] = unpack(page,off)[0]
+        return pc + 1
+    return op
+
+def decode_store(sim,a,b,imm,store):
+    # shared by all store instructions; 'store' writes a value of the
+    # appropriate size to main memory
+    r = sim.registers
+    if b is None:
+        # direct
+        def op(pc):
+            store(imm,r[a])
+            return pc + 1
     else:
-        runtime_error("could not execute system call {0}: no such service".format(v))
+        # indirect (i.e. from register)
+        def op(pc):
+            store(imm + r[b],r[a])
+            return pc + 1
+    return op
+
+def decode_sb(sim,a,b,c,imm):
+    return decode_store(sim,a,b,imm,sim.write_byte)
+
+def decode_sh(sim,a,b,c,imm):
+    return decode_store(sim,a,b,imm,sim.write_halfword)
+
+def decode_sw(sim,a,b,c,imm):
+    # see decode_lw
+    r = sim.registers
+    get = sim.memory.pages.get
+    pack = STRUCT_UWORD.pack_into
+    store = sim.write_word
+    shift, mask, last = PAGE_SHIFT, PAGE_MASK, PAGE_SIZE - 4
+    if b is None:
+        return decode_store(sim,a,b,imm,store)
+    def op(pc):
+        addr = imm + r[b]
+        page = get(addr >> shift)
+        off = addr & mask
+        if page is None or page is ZERO_PAGE or off > last:
+            store(addr,r[a])
+        else:
+            pack(page,off,r[a] & 0xffffffff)
+        return pc + 1
+    return op
+
+def decode_syscall(sim,a,b,c,imm):
+    def op(pc):
+        system_call(sim)
+        return pc + 1
+    return op
 
 # define useful constant information for the program
-STACK_SPACE = 1048576
-MIPS_INSTRUCTIONS = {'add':instr_add,'addu':instr_addu,'addi':instr_addi,'addiu':instr_addiu,
-                     'and':instr_and,'andi':instr_andi,'div':instr_div,'divu':instr_divu,
-                     'mul':instr_mul,'mulu':instr_mulu,'mult':instr_mult,'multu':instr_multu,
-                     'nor':instr_nor,'or':instr_or,'ori':instr_ori,'sll':instr_sll,'sllv':instr_sllv,
-                     'sra':instr_sra,'srav':instr_srav,'srl':instr_srl,'srlv':instr_srlv,'sub':instr_sub,
-                     'subu':instr_subu,'xor':instr_xor,'xori':instr_xori,'slt':instr_slt,
-                     'sltu':instr_sltu,'slti':instr_slti,'sltiu':instr_sltiu,'beq':instr_beq,'bgez':instr_bgez,
-                     'bgtz':instr_bgtz,'blez':instr_blez,'bne':instr_bne,'blt':instr_blt,'bgt':instr_bgt,
-                     'j':instr_j,'jal':instr_jal,'jalr':instr_jalr,'jr':instr_jr,'la':instr_la,'lhi':instr_lhi,
-                     'li':instr_li,'llo':instr_llo,'lb':instr_lb,'lbu':instr_lbu,'lh':instr_lh,'lhu':instr_lhu,
-                     'lw':instr_lw,'mfhi':instr_mfhi,'mflo':instr_mflo,'move':instr_move,'mthi':instr_mthi,
-                     'mtlo':instr_mtlo,'sb':instr_sb,'sh':instr_sh,'sw':instr_sw,'syscall':instr_syscall,
-                     'rem':instr_rem,'nop':lambda _,__,**___: True}
+STACK_SPACE = 1048576        # default size of the stack region in bytes
+MEMORY_SIZE = 1 << 28        # default size of the address space; the stack ends here
+PAGE_SHIFT = 16              # memory is allocated in pages of 1 << PAGE_SHIFT bytes
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+ZERO_PAGE = '\x00' * PAGE_SIZE  # shared by all pages that have not been written yet
+STRUCT_WORD = struct.Struct('<i')
+STRUCT_UWORD = struct.Struct('<I')
+STRUCT_HALF = struct.Struct('<h')
+STRUCT_UHALF = struct.Struct('<H')
+MIPS_INSTRUCTIONS = {'add':check_register_instr,'addu':check_register_instr,
+                     'and':check_register_instr,'mul':check_register_instr,
+                     'mulu':check_register_instr,'nor':check_register_instr,
+                     'or':check_register_instr,'sllv':check_register_instr,
+                     'srav':check_register_instr,'srlv':check_register_instr,
+                     'sub':check_register_instr,'subu':check_register_instr,
+                     'xor':check_register_instr,'slt':check_register_instr,
+                     'sltu':check_register_instr,'div':check_register_instr2,
+                     'divu':check_register_instr2,'mult':check_register_instr2,
+                     'multu':check_register_instr2,'move':check_register_instr2,
+                     'addi':check_immed_instr,'addiu':check_immed_instr,'andi':check_immed_instr,
+                     'ori':check_immed_instr,'xori':check_immed_instr,'slti':check_immed_instr,
+                     'sltiu':check_immed_instr,'rem':check_register_or_immed_instr,
+                     'sll':check_register_or_immed_instr,'sra':check_register_or_immed_instr,
+                     'srl':check_register_or_immed_instr,'beq':check_direct_instr2,
+                     'bne':check_direct_instr2,'blt':check_direct_instr2,
+                     'bgt':check_direct_instr2,'bgez':check_direct_instr,
+                     'bgtz':check_direct_instr,'blez':check_direct_instr,'lhi':check_direct_instr,
+                     'llo':check_direct_instr,'j':check_jump_instr,'jal':check_jump_instr,
+                     'jalr':check_jumpreg_instr,'jr':check_jumpreg_instr,
+                     'mfhi':check_jumpreg_instr,'mflo':check_jumpreg_instr,
+                     'mthi':check_jumpreg_instr,'mtlo':check_jumpreg_instr,
+                     'la':check_address_instr,'li':check_address_instr,'lb':check_memory_instr,
+                     'lbu':check_memory_instr,'lh':check_memory_instr,'lhu':check_memory_instr,
+                     'lw':check_memory_instr,'sb':check_memory_instr,'sh':check_memory_instr,
+                     'sw':check_memory_instr,'syscall':check_noarg_instr,
+                     'nop':lambda _,**__: True}
+MIPS_DECODERS = {'j':decode_j,'jal':decode_jal,'jalr':decode_jalr,'jr':decode_jr,
+                 'lb':decode_lb,'lbu':decode_lb,'lh':decode_lh,'lhu':decode_lh,'lw':decode_lw,
+                 'sb':decode_sb,'sh':decode_sh,'sw':decode_sw,'syscall':decode_syscall}
 MIPS_REGISTERS = {'$0' : 0, '$zero' : 0, '$r0' : 0,
                   '$1' : 4,'$at' : 4, '$2' : 8, '$v0' : 8,
                   '$3' : 12,'$v1' : 12, '$4' : 16, '$a0' : 16,
@@ -726,70 +589,236 @@ MIPS_REGISTERS = {'$0' : 0, '$zero' : 0, '$r0' : 0,
                   '$27' : 108, '$k1' : 108, '$28' : 112, '$gp' : 112,
                   '$29' : 116, '$sp' : 116, '$30' : 120, '$fp' : 120, '$s8' : 120,
                   '$31' : 124, '$ra' : 124, 'HI' : 128, 'LO' : 132}
+REG_RA = MIPS_REGISTERS['$ra'] >> 2 # indices into the register file
+REG_V0 = MIPS_REGISTERS['$v0'] >> 2
+REG_SP = MIPS_REGISTERS['$sp'] >> 2
+REG_HI = MIPS_REGISTERS['HI'] >> 2
+REG_LO = MIPS_REGISTERS['LO'] >> 2
+REG_COUNT = REG_LO + 1
+# the semantics of each instruction that does not transfer control,
+# shared by the interpreter (see decode_semantics), the translator and
+# the optimizer: '{a}', '{b}' and '{c}' are replaced by the register
+# operands (or the immediate when an instruction takes one in place of
+# a register); '{imm}' is the immediate, '{imms}'/'{immu}' are its
+# signed and unsigned 32-bit forms and '{immw}' is the immediate plus
+# 0x80000000 (a sum is wrapped to a signed word with one mask and one
+# subtraction); '{addr}' is the effective address of a load/store;
+# statements are separated by '; '; loads, stores and jumps are
+# decoded by hand, so their templates are only used by the translator
+MIPS_SEMANTICS = {'add':'{a} = (({b} + {c} + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'addi':'{a} = (({b} + {immw}) & 0xffffffff) - 0x80000000',
+                  'and':'{a} = {b} & {c}',
+                  'andi':'{a} = ((({b} & {imm}) + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'div':'_t = {a}; _u = {b}; {hi} = _t % _u; {lo} = ((_t // _u + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'mul':'{a} = (({b} * {c} + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'mult':'_t = {a} * {b}; {hi} = (((_t >> 32) + 0x80000000) & 0xffffffff) - 0x80000000; '
+                         '{lo} = ((_t + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'nor':'{a} = ~({b} | {c})',
+                  'or':'{a} = {b} | {c}',
+                  'ori':'{a} = ((({b} | {imm}) + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'rem':'{a} = (({b} % {c} + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'sll':'{a} = ((({b} << {c}) + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'sra':'_t = {b}; _u = {c}; {a} = (_t >> _u) & ~((-1 if _t & 0x80000000 else 0) >> _u)',
+                  'srl':'{a} = {b} >> {c}',
+                  'sub':'{a} = (({b} - {c} + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'xor':'{a} = {b} ^ {c}',
+                  'xori':'{a} = ((({b} ^ {immu}) + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'slt':'{a} = 1 if {b} < {c} else 0',
+                  'sltu':'{a} = 1 if {b} & 0xffffffff < {c} & 0xffffffff else 0',
+                  'slti':'{a} = 1 if {b} < {imms} else 0',
+                  'sltiu':'{a} = 1 if {b} & 0xffffffff < {immu} else 0',
+                  'la':'{a} = (({b} + {immw}) & 0xffffffff) - 0x80000000',
+                  'lhi':'{a} = (((({a} & 0xffff) | ({imm} << 16)) + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'llo':'{a} = (((({a} & 0xffff0000) | ({imm} << 16)) + 0x80000000) & 0xffffffff) - 0x80000000',
+                  'lb':'{a} = rb({addr})','lh':'{a} = rh({addr})','sb':'wb({addr},{a})','sh':'wh({addr},{a})',
+                  # words are read and written within a page directly (see decode_lw)
+                  'lw':'_a = {{addr}}; _p = pg(_a >> {0}); _o = _a & {1}; '
+                       '{{a}} = uw(_p,_o)[0] if _p is not None and _o <= {2} else rw(_a)'.format(
+                           PAGE_SHIFT,PAGE_MASK,PAGE_SIZE - 4),
+                  'sw':'_a = {{addr}}; _p = pg(_a >> {0}); _o = _a & {1}; '
+                       'ww(_a,{{a}}) if _p is None or _p is zp or _o > {2} else pw(_p,_o,{{a}} & 0xffffffff)'.format(
+                           PAGE_SHIFT,PAGE_MASK,PAGE_SIZE - 4),
+                  'move':'{a} = {b}','mfhi':'{a} = {hi}','mflo':'{a} = {lo}',
+                  'mthi':'{hi} = {a}','mtlo':'{lo} = {a}','nop':'pass'}
+MIPS_ALIASES = {'addu':'add','addiu':'addi','divu':'div','mulu':'mul','multu':'mult','sllv':'sll',
+                'srav':'sra','srlv':'srl','subu':'sub','li':'la','lbu':'lb','lhu':'lh'}
+for alias, iname in MIPS_ALIASES.iteritems():
+    MIPS_SEMANTICS[alias] = MIPS_SEMANTICS[iname]
+MIPS_BRANCHES = {'beq':'{a} == {b}','bne':'{a} != {b}','blt':'{a} < {b}','bgt':'{a} > {b}',
+                 'bgez':'{a} >= 0','bgtz':'{a} > 0','blez':'{a} <= 0'}
+MIPS_JUMPS = ['j','jal','jalr','jr']
+for iname in itertools.chain(MIPS_SEMANTICS,MIPS_BRANCHES):
+    if iname not in MIPS_DECODERS:
+        MIPS_DECODERS[iname] = functools.partial(decode_semantics,name=MIPS_ALIASES.get(iname,iname))
+# groups of adjacent instructions that are run as one operation (see
+# MIPSSimulator.enable_fusion); aliases (e.g. 'addiu') match too
+MIPS_FUSIONS = set(tuple(MIPS_ALIASES.get(name,name) for name in group) for group in (
+    # stack frames
+    ('addi','sw','sw'),('addi','sw','move'),('lw','lw','addi'),('lw','addi','jr'),
+    ('addi','sw'),('sw','sw'),('lw','lw'),('lw','addi'),('addi','jr'),('move','lw'),
+    # compare and branch
+    ('slt','beq'),('slt','bne'),('slti','beq'),('slti','bne'),
+    ('sltu','beq'),('sltu','bne'),('sltiu','beq'),('sltiu','bne'),
+    # calls and jumps
+    ('move','jal'),('addi','jal'),('li','jal'),('move','j'),
+    # system calls
+    ('li','syscall'),('move','syscall')))
 STRING_ESCAPES = ((r'\\a','\x07'),(r'\\b','\x08'),(r'\\f','\x0c'),(r'\\n','\x0a'),
                   (r'\\r','\x0d'),(r'\\t','\x09'),(r'\\v','\x0b'),(r'\\\\',r'\x5c'),
                   (r'\\\'','\x27'),(r'\\"','\x22'),(r'\\([0-7]{3})',lambda x:chr(int(x.group(1),8))),
                   (r'\\([0-9a-f]{2})',lambda x:chr(int(x.group(1),16))))
+ASSEMBLER_VERSION = 3        # bump when the assembler's output changes
+STREAM_CHUNK = 1 << 16       # approximate number of bytes of source assembled at a time
+CACHE_SUFFIX = ".mips"       # assembled program cache entries
+CACHE_SIZE = 64 << 20        # default bound on the size of the cache in bytes
+CACHE_LOG = 4096             # number of logged cache lookups folded into the counters at a time
+CACHE_COUNTS = struct.Struct('<QQ') # cache hits, misses
+TRANSLATION_SUFFIX = ".pyc"  # translation cache file written next to an executable
+TRANSLATION_VERSION = 5      # bump when generated code changes
+TRANSLATION_BIND = "def bind(r,rw,rh,rb,ww,wh,wb,sc,pg,uw,pw,zp,bo,t):"
+TRANSLATION_LOCAL = "r{0}"   # name of the local variable holding a register
+HOT_THRESHOLD = 1000         # default number of back-edges before a loop is compiled
+PROFILE_TOP = 20             # number of instructions listed in a profile report
+OUTPUT_BUFFER = 1 << 16      # number of bytes of program output buffered before writing it
+LIMIT_STEPS = 10000          # number of instructions run between checks of the limits
+LIMIT_STATUS = 124           # exit status when a program exceeds a limit
+SLICE_STEPS = 1000           # number of instructions a hosted session runs before the next one
+SERVE_PORT = 7373            # default port for --serve
+SYSCALL_NAMES = {1:'print_int',4:'print_string',5:'read_int',8:'read_string',9:'sbrk',10:'exit',
+                 11:'print_character',12:'read_character',13:'open',14:'read',15:'write',16:'close'}
 LABEL_INSTRS = ['beq','bgez','bgtz','blez','bne','blt','bgt','j','jal','jalr','jr','la','lb','lbu','lh','lhu',
                 'lw','sw','sh','sw'] # only these instructions can resolve labels
 SHEBANG = "#!/usr/bin/env pymips\n"
+MIPS_OPCODES = ('add','addu','addi','addiu','and','andi','div','divu','mul','mulu','mult','multu',
+                'nor','or','ori','sll','sllv','sra','srav','srl','srlv','sub','subu','xor','xori',
+                'slt','sltu','slti','sltiu','beq','bgez','bgtz','blez','bne','blt','bgt',
+                'j','jal','jalr','jr','la','lhi','li','llo','lb','lbu','lh','lhu','lw',
+                'mfhi','mflo','move','mthi','mtlo','sb','sh','sw','syscall','rem','nop')
+REGISTER_NAMES = ('$zero','$at','$v0','$v1','$a0','$a1','$a2','$a3',
+                  '$t0','$t1','$t2','$t3','$t4','$t5','$t6','$t7',
+                  '$s0','$s1','$s2','$s3','$s4','$s5','$s6','$s7',
+                  '$t8','$t9','$k0','$k1','$gp','$sp','$fp','$ra','HI','LO')
+EXE_MAGIC = "PYMX"                        # follows the shebang in binary executables
+EXE_VERSION = 2                           # version 1 stored constants as text
+EXE_HEADER = struct.Struct('<HH')         # version, number of sections
+EXE_SECTION = struct.Struct('<4sII')      # tag, file offset, length
+EXE_RECORD = struct.Struct('<BBBBi')      # opcode, registers a/b/c, immediate
+EXE_SYMBOL = struct.Struct('<BiH')        # kind, address, length of name
+EXE_SYMBOL_KINDS = ('text','data')
+EXE_LINE = struct.Struct('<I')            # source line of an instruction
+EXE_NOREG = 0xff                          # register slot not used
+EXE_CONSTANT = 0x80                       # opcode flag: immediate indexes the constant table
+EXE_OPCODE = ''.join(chr(i & ~EXE_CONSTANT) for i in xrange(256))  # strips EXE_CONSTANT
+REGEX_CONSTANT = re.compile('[\x80-\xff]')  # opcodes flagged with EXE_CONSTANT
+EXE_NOIMM = ('add','addu','and','div','divu','mul','mulu','mult','multu','nor','or','sllv','srav',
+             'srlv','sub','subu','xor','slt','sltu','jalr','jr','mfhi','mflo','move','mthi',
+             'mtlo','syscall','nop')
+EXE_INDIRECT = ('la','li','lb','lbu','lh','lhu','lw','sb','sh','sw')
 
 class MIPSSystem:
     REGEX_TOKEN = re.compile('\s*([^\s]+)')
-    def __init__(self):
+
+    # every system that may hold buffered output; see 'flush_all'
+    instances = weakref.WeakSet()
+
+    def __init__(self,infile=stdin,outfile=stdout,errfile=stderr):
+        # the process reads its input from 'infile' and writes its
+        # output to 'outfile' (and to 'errfile' for descriptor 2);
+        # output is collected in a buffer that is
+        # flushed when it fills up, when the program exits or reads
+        # input and before an error is reported; input is read a line
+        # at a time into a buffer that is consumed from an offset
+        self.infile = infile
+        self.outfile = outfile
+        self.errfile = errfile
+        self.out = bytearray()
         self.buf = ""
-        self.fdtable = {}
+        self.pos = 0
+        self.fdtable = {} # files opened by the program by descriptor
+        MIPSSystem.instances.add(self)
+
+    @staticmethod
+    def flush_all():
+        # flush the output of every system (e.g. before reporting an
+        # error so that output appears in order)
+        for system in list(MIPSSystem.instances):
+            system.flush()
+
+    def flush(self):
+        if self.out:
+            self.outfile.write(self.out)
+            del self.out[:]
+        self.outfile.flush()
+
+    def write(self,s):
+        out = self.out
+        out += s
+        if len(out) >= OUTPUT_BUFFER:
+            self.flush()
 
     def exit(self,v):
+        self.flush()
         exit(v)
     def print_int(self,i):
-        stdout.write("{0}".format(i))
+        self.write("{0}".format(i))
     def print_string(self,s):
-        stdout.write(s)
+        self.write(s)
     def print_character(self,v):
-        stdout.write(chr(v))
+        self.write(chr(v))
+
+    def readline(self):
+        # replace the input buffer with the next line of input; return
+        # False at the end of the input
+        self.buf = self.infile.readline()
+        self.pos = 0
+        return len(self.buf) > 0
 
     def read_int(self):
+        self.flush()
         tok = self.read_token()
         return int(tok)
     def read_character(self):
-        # return the character as an integer (its ordinal value)
-        c = self.buf[:1]
-        if len(c) == 0:
-            self.buf = stdin.readline()
-            if len(self.buf) == 0:
-                runtime_error("unexpected EOF on read operation")
-            c = self.buf[:1]
-            self.buf = self.buf[1:]
-        return ord(c)
+        # return the character as an integer (its ordinal value); note
+        # that the buffer is only consumed when it has to be refilled
+        self.flush()
+        if self.pos < len(self.buf):
+            return ord(self.buf[self.pos])
+        if not self.readline():
+            raise MIPSError("unexpected EOF on read operation")
+        self.pos = 1
+        return ord(self.buf[0])
     def read_string(self,sim,addr,amount):
         # this works similarly to 'fgets'
-        s = ""
+        self.flush()
+        chunks = []
 
-        # pop off anything from the buffer within the amount of bytes
+        # take anything from the buffer within the amount of bytes
         # requested or until a newline has been read; if the buffer
         # becomes empty before we have read the requisite number of
         # bytes, read another line into the buffer
         while amount > 0:
             # check for newlines in the input stream
-            p = self.buf.find("\n")
+            buf = self.buf
+            pos = self.pos
+            p = buf.find("\n",pos)
             if p != -1:
                 p += 1 # include newline in buffer (potentially)
-                if p > amount:
-                    p = amount
-                s += self.buf[:p]
-                self.buf = self.buf[p:]
+                if p - pos > amount:
+                    p = pos + amount
+                chunks.append(buf[pos:p])
+                self.pos = p
                 break
-            amount -= len(self.buf)
-            s += self.buf[:amount]
-            self.buf = self.buf[amount:]
-            if len(self.buf) == 0:
-                self.buf = stdin.readline()
-                if len(self.buf) == 0:
+            n = min(amount,len(buf) - pos)
+            chunks.append(buf[pos:pos+n])
+            amount -= n
+            self.pos = pos + n
+            if self.pos == len(buf):
+                if not self.readline():
                     break
 
         # write the string into simulator's memory at the specified
         # address and return the number of bytes written
+        s = "".join(chunks)
         sim.write_memory(addr,s)
         return len(s)
 
@@ -797,164 +826,1712 @@ class MIPSSystem:
         # if we cannot read a token from the buffer, then the buffer
         # needs to be updated
         while True:
-            m = MIPSSystem.REGEX_TOKEN.match(self.buf)
+            m = MIPSSystem.REGEX_TOKEN.match(self.buf,self.pos)
             if m:
                 break
             # if we didn't match then only whitespaces were in the
             # buffer; so replace the buffer with a new line
-            self.buf = stdin.readline()
-            if len(self.buf) == 0:
-                runtime_error("unexpected EOF on read operation")
-        tok = m.group(1)
-        self.buf = self.buf[m.end(1):]
-        return tok
+            if not self.readline():
+                raise MIPSError("unexpected EOF on read operation")
+        self.pos = m.end(1)
+        return m.group(1)
+
+    # file system calls: descriptors 0, 1 and 2 are the process' input,
+    # output and stderr; input and output go through the same buffers
+    # as the other system calls; files opened by the program are kept
+    # unbuffered in 'fdtable' and data is copied between them and the
+    # pages of simulator memory directly
+
+    def open_file(self,name,flags,mode):
+        # 'flags' is 0 to read, 1 to write or 2 for both, plus 8 to
+        # append; a file opened for writing is created if it does not
+        # exist (with permissions 'mode', or 0666 if it is zero) and is
+        # truncated unless it is appended to or also opened to read
+        access = flags & 3
+        if access == 3:
+            return -1
+        oflags = (os.O_RDONLY,os.O_WRONLY,os.O_RDWR)[access]
+        if access != 0:
+            oflags |= os.O_CREAT
+            if flags & 8:
+                oflags |= os.O_APPEND
+            elif access == 1:
+                oflags |= os.O_TRUNC
+        try:
+            f = io.FileIO(os.open(name,oflags,mode & 0777 or 0666),('r','w','r+')[access])
+        except (OSError,IOError):
+            return -1
+        fd = 3
+        while fd in self.fdtable:
+            fd += 1
+        self.fdtable[fd] = f
+        return fd
+
+    def read_file(self,memory,fd,addr,amount):
+        if amount < 0:
+            return -1
+        if fd == 0:
+            # take what is left of the current line of input (or read
+            # the next one), like reading from a terminal
+            self.flush()
+            if self.pos == len(self.buf) and not self.readline():
+                return 0
+            chunk = self.buf[self.pos:self.pos+amount]
+            memory.write_memory(addr,chunk)
+            self.pos += len(chunk)
+            return len(chunk)
+        f = self.fdtable.get(fd)
+        if f is None or not f.readable():
+            return -1
+        total = 0
+        try:
+            for view in memory.views(addr,amount,True):
+                n = f.readinto(view) or 0
+                total += n
+                if n < len(view):
+                    break
+        except IOError:
+            return total or -1
+        return total
+
+    def write_file(self,memory,fd,addr,amount):
+        if amount < 0:
+            return -1
+        if fd == 1:
+            for view in memory.views(addr,amount):
+                self.write(view)
+            return amount
+        if fd == 2:
+            self.flush()
+            self.errfile.write(memory.read_memory(addr,amount))
+            return amount
+        f = self.fdtable.get(fd)
+        if f is None or not f.writable():
+            return -1
+        total = 0
+        try:
+            for view in memory.views(addr,amount):
+                while len(view):
+                    n = f.write(view)
+                    total += n
+                    view = view[n:]
+        except IOError:
+            return total or -1
+        return total
+
+    def close_file(self,fd):
+        f = self.fdtable.pop(fd,None)
+        if f is None:
+            return -1
+        f.close()
+        return 0
+
+class MIPSInstructions:
+    # a read-only sequence of instructions stored as parallel columns:
+    # the opcode (an index into MIPS_OPCODES), the three register
+    # slots and the immediate of every instruction are split out of a
+    # buffer of fixed-width records (see EXE_RECORD) into arrays, so a
+    # program takes a few bytes per instruction and loading it creates
+    # no objects per instruction; the buffer may be a mapped file and
+    # the columns are only split out of it when they are first used
+    # (a program that is just assembled and written never needs
+    # them); the simulator and the translator read the columns
+    # directly (see 'op'); instructions are only turned into lists
+    # when they are accessed as such
+    COLUMNS = ('opcodes','regA','regB','regC','imms','large')
+
+    def __init__(self,buf,offset,count,constants=()):
+        self.buf = buf
+        self.offset = offset
+        self.count = count
+        self.constants = constants
+
+    def __getattr__(self,name):
+        if name not in MIPSInstructions.COLUMNS:
+            raise AttributeError(name)
+        self.split()
+        return getattr(self,name)
+
+    def split(self):
+        # read the records straight from the buffer as pairs of words
+        # (the opcode and registers, then the immediate); the bytes of
+        # the first words are then split into their own columns
+        words = array.array('i')
+        words.fromstring(buffer(self.buf,self.offset,self.count*EXE_RECORD.size))
+        heads = array.array('B')
+        heads.fromstring(buffer(words[0::2]))
+        del words[0::2]
+        if byteorder == 'big':
+            words.byteswap()
+        self.imms = words
+        opcodes = heads[0::4].tostring()
+        # immediates that did not fit in a record; these are rare
+        self.large = dict((m.start(),self.constants[words[m.start()]])
+                          for m in REGEX_CONSTANT.finditer(opcodes))
+        self.opcodes = array.array('B',opcodes.translate(EXE_OPCODE))
+        self.regA = heads[1::4]
+        self.regB = heads[2::4]
+        self.regC = heads[3::4]
 
-class MIPSSimulator:
-    def __init__(self,f):
-        # load information from pickle file; this consists of the
-        # program's text instructions and its data segment memory; we
+    @staticmethod
+    def pack(instrs):
+        # store instructions given as lists (as produced by the
+        # assembler)
+        text = bytearray()
+        constants = []
+        for parts in instrs:
+            text += MIPSProgram.encode(parts,constants)
+        return MIPSInstructions(text,0,len(text) // EXE_RECORD.size,constants)
+
+    def __len__(self):
+        return self.count
+
+    def op(self,pc):
+        # return the name and operands of an instruction as a tuple of
+        # (name,a,b,c,imm) where registers are indices into the
+        # register file; missing operands are None
+        name = MIPS_OPCODES[self.opcodes[pc]]
+        a, b, c = self.regA[pc], self.regB[pc], self.regC[pc]
+        imm = None
+        if c == EXE_NOREG and name not in EXE_NOIMM:
+            # no instruction has three registers and an immediate
+            imm = self.large[pc] if pc in self.large else self.imms[pc]
+        return (name,None if a == EXE_NOREG else a,None if b == EXE_NOREG else b,
+                None if c == EXE_NOREG else c,imm)
+
+    def __getitem__(self,pc):
+        if pc < 0:
+            pc += self.count
+        if pc < 0 or pc >= self.count:
+            raise IndexError('instruction offset out of range')
+        name, a, b, c, imm = self.op(pc)
+        parts = [name]
+        parts.extend(REGISTER_NAMES[x] for x in (a,b,c) if x is not None)
+        if imm is None:
+            return parts
+        # an immediate comes last except for indirect addressing
+        # where it sits between the two registers
+        if len(parts) == 3 and name in EXE_INDIRECT:
+            parts.insert(2,imm)
+        else:
+            parts.append(imm)
+        return parts
+
+    def __iter__(self):
+        for pc in xrange(self.count):
+            yield self[pc]
+
+class MIPSProgram:
+    # an assembled program: its instructions, the initial contents of
+    # its data segment and (optionally) its symbol table, which maps
+    # label names to ('text'|'data',address) pairs, and the source
+    # line of each instruction (packed as EXE_LINE records);
+    # instructions given as lists are stored as MIPSInstructions
+
+    def __init__(self,instr,data,symbols=None,lines=None):
+        if not isinstance(instr,MIPSInstructions):
+            instr = MIPSInstructions.pack(instr)
+        self.instr = instr
+        self.data = data
+        self.symbols = symbols or {}
+        self.lines = lines
+
+    def line(self,pc):
+        # return the source line of an instruction if it is known
+        if not self.lines or not 0 <= pc < len(self.lines) // EXE_LINE.size:
+            return None
+        return EXE_LINE.unpack_from(self.lines,pc*EXE_LINE.size)[0]
+
+    def location(self,pc):
+        # describe an instruction offset relative to the closest text
+        # label at or before it (e.g. 'loop+3')
+        if not hasattr(self,'textLabels'):
+            self.textLabels = sorted((addr,name) for name, (kind, addr) in self.symbols.iteritems()
+                                     if kind == 'text')
+        i = bisect.bisect_right(self.textLabels,(pc,'\xff'))
+        if i == 0:
+            return str(pc)
+        addr, name = self.textLabels[i-1]
+        return name if addr == pc else "{0}+{1}".format(name,pc - addr)
+
+    def disassemble(self,pc):
+        # format an instruction as assembly; branch and jump targets
+        # are given as locations (see 'location')
+        parts = self.instr[pc]
+        if parts[0] in MIPS_BRANCHES or parts[0] in ('j','jal'):
+            parts = parts[:-1] + [self.location(parts[-1])]
+        return format_instr(parts)
+
+    @staticmethod
+    def load(f):
+        # load a program from an executable file; the file may either
+        # be in the current binary format or an older pickle file; we
         # first must read off the shebang that lets the file be
-        # executable; then the file stream is ready to be unpickled
-        f.read(len(SHEBANG))
-        t = pickle.load(f)
-        self.instr = t[0]
-        self.memory = io.BytesIO(t[1]) # main memory
-        datalen = self.memory.seek(0,2) # calculate number of bytes in data segment
-        self.memory.seek(0)
-
-        # allocate registers as a memory stream; each register has a
-        # constant offset into this memory
-        self.regmem = io.BytesIO()
-        self.regmem.seek(200)
-        self.regmem.write("\x00")
-        self.regmem.seek(0)
-
-        # position the stack pointer register at the top of the main
-        # memory stream
-        self.maxaddr = STACK_SPACE + datalen
-        self.write_register('$sp',self.maxaddr)
+        # executable
+        shebang = f.read(len(SHEBANG))
+        magic = f.read(len(EXE_MAGIC))
+        if magic != EXE_MAGIC:
+            # the file is a pickled tuple of (instructions,data)
+            t = pickle.loads(magic + f.read())
+            return MIPSProgram(t[0],t[1])
+
+        # map the file into memory if possible; everything else is
+        # decoded lazily from the buffer; a stream that cannot be
+        # mapped (e.g. a pipe) may not be able to seek either, so the
+        # buffer is what was read so far followed by the rest of it
+        try:
+            buf = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        except (AttributeError,EnvironmentError,ValueError):
+            buf = shebang + magic + f.read()
+        version, count = EXE_HEADER.unpack_from(buf,len(SHEBANG) + len(EXE_MAGIC))
+        if version > EXE_VERSION:
+            raise MIPSError("executable format version {0} is not supported".format(version))
+        sections = {}
+        pos = len(SHEBANG) + len(EXE_MAGIC) + EXE_HEADER.size
+        for _ in xrange(count):
+            tag, offset, length = EXE_SECTION.unpack_from(buf,pos)
+            sections[tag] = (offset,length)
+            pos += EXE_SECTION.size
+
+        offset, length = sections['CNST']
+        if version < 2:
+            constants = [int(x) for x in buf[offset:offset+length].split()]
+        else:
+            constants = MIPSProgram.unpack_constants(buf,offset,length)
+        offset, length = sections['TEXT']
+        instr = MIPSInstructions(buf,offset,length // EXE_RECORD.size,constants)
+        offset, length = sections['DATA']
+        data = buf[offset:offset+length]
+        symbols = {}
+        if 'SYMS' in sections:
+            offset, length = sections['SYMS']
+            end = offset + length
+            while offset < end:
+                kind, addr, n = EXE_SYMBOL.unpack_from(buf,offset)
+                offset += EXE_SYMBOL.size
+                symbols[buf[offset:offset+n]] = (EXE_SYMBOL_KINDS[kind],addr)
+                offset += n
+        lines = None
+        if 'LINE' in sections:
+            offset, length = sections['LINE']
+            lines = buf[offset:offset+length]
+        return MIPSProgram(instr,data,symbols,lines)
 
-        # create the program counter (this is the offset within the
-        # list of instructions of the next instruction to execute)
-        self.progCounter = 0
+    @staticmethod
+    def encode(parts,constants):
+        # pack an instruction as a fixed-width record of (opcode,
+        # registers,immediate); immediates that do not fit in 32 bits
+        # are appended to 'constants'
+        a, b, c, imm = decode_operands(parts)
+        opid = MIPS_OPCODES.index(parts[0])
+        if imm is None:
+            imm = 0
+        elif not -0x80000000 <= imm <= 0x7fffffff:
+            opid |= EXE_CONSTANT
+            constants.append(imm)
+            imm = len(constants) - 1
+        return EXE_RECORD.pack(opid,*[EXE_NOREG if x is None else x for x in (a,b,c)] + [imm])
 
-    def write_register(self,reg,value):
-        # each register is a 4-byte word; value should be a Python
-        # 'long/int' that we wrap into a word and write to the memory
-        # stream
-        self.regmem.seek(MIPS_REGISTERS[reg])
-        self.regmem.write(struct.pack('<i',ctypes.c_int32(value).value))
+    @staticmethod
+    def pack_constants(constants):
+        # pack the table of constants as words: each constant is the
+        # number of words that follow and then the value in 32-bit
+        # pieces, least significant first, the last one signed
+        words = array.array('i')
+        for x in constants:
+            pieces = []
+            while True:
+                low = x & 0xffffffff
+                x >>= 32
+                pieces.append(((low + 0x80000000) & 0xffffffff) - 0x80000000)
+                if x == (-1 if low & 0x80000000 else 0):
+                    break
+            words.append(len(pieces))
+            words.extend(pieces)
+        if byteorder == 'big':
+            words.byteswap()
+        return words.tostring()
 
-    def read_register(self,reg):
-        # read a 4-byte value from the register memory stream; the
-        # result should be a Python 'long/int'
-        self.regmem.seek(MIPS_REGISTERS[reg])
-        mem = self.regmem.read(4)
-        return struct.unpack('<i',mem)[0]
+    @staticmethod
+    def unpack_constants(buf,offset,length):
+        # the inverse of 'pack_constants'
+        constants = []
+        end = offset + length
+        while offset < end:
+            n = STRUCT_WORD.unpack_from(buf,offset)[0]
+            pieces = [STRUCT_WORD.unpack_from(buf,offset + 4*i)[0] for i in xrange(1,n + 1)]
+            offset += 4*(n + 1)
+            x = pieces.pop()
+            while pieces:
+                x = (x << 32) | (pieces.pop() & 0xffffffff)
+            constants.append(x)
+        return constants
+
+    def write(self,f):
+        # write the program in the binary executable format: a
+        # shebang, a header and a directory of sections; instructions
+        # are packed as fixed-width records (see encode); immediates
+        # that do not fit in 32 bits are stored in a table of
+        # constants (see pack_constants); the records are written
+        # straight from the buffer they are stored in
+        text = buffer(self.instr.buf,self.instr.offset,len(self.instr)*EXE_RECORD.size)
+        symbols = bytearray()
+        for name, (kind, addr) in sorted(self.symbols.iteritems()):
+            symbols += EXE_SYMBOL.pack(EXE_SYMBOL_KINDS.index(kind),addr,len(name)) + name
+        sections = [('TEXT',text),('DATA',self.data),
+                    ('CNST',MIPSProgram.pack_constants(self.instr.constants)),('SYMS',symbols)]
+        if self.lines is not None:
+            sections.append(('LINE',self.lines))
+
+        offset = len(SHEBANG) + len(EXE_MAGIC) + EXE_HEADER.size + EXE_SECTION.size*len(sections)
+        f.write(SHEBANG)
+        f.write(EXE_MAGIC)
+        f.write(EXE_HEADER.pack(EXE_VERSION,len(sections)))
+        for tag, content in sections:
+            f.write(EXE_SECTION.pack(tag,offset,len(content)))
+            offset += len(content)
+        for tag, content in sections:
+            f.write(content)
+
+class MIPSMemory:
+    # main memory: the address space is divided into pages that are
+    # only allocated when they are first written to; it holds three
+    # regions: the data segment starting at address zero, the heap
+    # right after it and the stack which ends at the top of the
+    # address space; addresses outside of the regions (rounded to
+    # whole pages) cause segmentation faults
+
+    def __init__(self,data,stackSize=STACK_SPACE,size=MEMORY_SIZE):
+        # every page of a region is in 'pages'; a page that has not
+        # been written to is ZERO_PAGE (which is read-only)
+        stackSize = (stackSize + PAGE_MASK) & ~PAGE_MASK
+        self.size = size & ~PAGE_MASK
+        self.stackBottom = self.size - stackSize
+        self.dataSize = len(data)
+        self.pages = {}
+        if self.stackBottom < (self.dataSize + PAGE_MASK) & ~PAGE_MASK or self.size > 0x7fffffff:
+            raise MIPSError("the data segment and a {0} byte stack do not fit in {1} bytes of "
+                            "memory".format(stackSize,size))
+        for n in xrange(self.stackBottom >> PAGE_SHIFT,self.size >> PAGE_SHIFT):
+            self.pages[n] = ZERO_PAGE
+        for n in xrange((self.dataSize + PAGE_MASK) >> PAGE_SHIFT):
+            self.pages[n] = ZERO_PAGE
+        self.reset(data)
+
+    def reset(self,data):
+        # return memory to its initial contents: the data segment 'data'
+        # (of the same size as before) and an empty heap; pages that
+        # have been allocated in the data segment or stack are cleared
+        # in place and kept for reuse
+        heap, stack = (self.dataSize + PAGE_MASK) >> PAGE_SHIFT, self.stackBottom >> PAGE_SHIFT
+        for n, page in self.pages.items():
+            if heap <= n < stack:
+                del self.pages[n]
+            elif page is not ZERO_PAGE:
+                page[:] = ZERO_PAGE
+        self.brk = self.brkMax = self.dataSize
+        for addr in xrange(0,self.dataSize,PAGE_SIZE):
+            chunk = data[addr:addr+PAGE_SIZE]
+            if chunk.count('\x00') != len(chunk):
+                self.write_memory(addr,chunk)
+
+    def sbrk(self,amount):
+        # grow (or shrink, if 'amount' is negative) the heap by 'amount'
+        # bytes rounded up to a whole word; return the old end of the
+        # heap; growing only adds the new pages as ZERO_PAGE so nothing
+        # is copied, and pages left entirely above the heap by
+        # shrinking it are dropped (their contents are lost)
+        brk = self.brk
+        end = (brk + amount + 3) & ~3
+        if end > self.stackBottom:
+            raise Exception('out of memory: the heap cannot grow into the stack')
+        if end < self.dataSize:
+            raise Exception('sbrk: the heap cannot shrink into the data segment')
+        first, last = (brk + PAGE_MASK) >> PAGE_SHIFT, (end + PAGE_MASK) >> PAGE_SHIFT
+        for n in xrange(first,last):
+            self.pages[n] = ZERO_PAGE
+        for n in xrange(last,first):
+            del self.pages[n]
+        self.brk = end
+        self.brkMax = max(self.brkMax,end)
+        return brk
+
+    def page(self,n,write):
+        # return page 'n' for reading or writing; allocate it if it is
+        # written for the first time
+        page = self.pages.get(n)
+        if page is None:
+            raise Exception('segmentation fault: attempted to {0} outside of allocated memory segment'.format(
+                'write' if write else 'read'))
+        if write and page is ZERO_PAGE:
+            page = self.pages[n] = bytearray(PAGE_SIZE)
+        return page
 
     def write_memory(self,addr,data):
-        # write some data to the main memory stream
-        if addr+len(data) > self.maxaddr or addr < 0:
-            raise Exception('segmentation fault: attempted to write outside of allocated memory segment')
-        self.memory.seek(addr)
-        return self.memory.write(data)
+        # write some data to main memory
+        end = addr + len(data)
+        if addr < 0:
+            self.page(-1,True)
+        i = 0
+        while addr < end:
+            page = self.page(addr >> PAGE_SHIFT,True)
+            off = addr & PAGE_MASK
+            n = min(PAGE_SIZE - off,end - addr)
+            page[off:off+n] = data[i:i+n]
+            addr += n
+            i += n
+        return len(data)
 
     def read_memory(self,addr,length):
         # read some data from main memory
-        if addr+length > self.maxaddr or addr < 0:
-            raise Exception('segmentation fault: attempted to read outside of allocated memory segment')
-        self.memory.seek(addr)
-        return self.memory.read(length)
+        end = addr + length
+        if addr < 0:
+            self.page(-1,False)
+        s = bytearray()
+        while addr < end:
+            page = self.page(addr >> PAGE_SHIFT,False)
+            off = addr & PAGE_MASK
+            n = min(PAGE_SIZE - off,end - addr)
+            s += buffer(page,off,n)
+            addr += n
+        return str(s)
+
+    # the word and half-word accessors use precompiled structures that
+    # pack/unpack in place so that a load or store allocates nothing;
+    # values are truncated to the size being written; accesses that
+    # cross a page boundary or touch a page for the first time take
+    # the slow path through read_memory/write_memory
 
     def write_word(self,addr,value):
         # write a word to main memory
-        self.write_memory(addr,struct.pack('<i',ctypes.c_int32(value).value))
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        off = addr & PAGE_MASK
+        if page is None or page is ZERO_PAGE or off > PAGE_SIZE - 4:
+            self.write_memory(addr,STRUCT_UWORD.pack(value & 0xffffffff))
+        else:
+            STRUCT_UWORD.pack_into(page,off,value & 0xffffffff)
 
     def read_word(self,addr):
         # read a word from main memory
-        mem = self.read_memory(addr,4)
-        return struct.unpack('<i',mem)[0]
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        off = addr & PAGE_MASK
+        if page is None or off > PAGE_SIZE - 4:
+            return STRUCT_WORD.unpack(self.read_memory(addr,4))[0]
+        return STRUCT_WORD.unpack_from(page,off)[0]
 
     def write_halfword(self,addr,value):
-        self.write_memory(addr,struct.pack('<h',ctypes.c_int16(value).value))
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        off = addr & PAGE_MASK
+        if page is None or page is ZERO_PAGE or off > PAGE_SIZE - 2:
+            self.write_memory(addr,STRUCT_UHALF.pack(value & 0xffff))
+        else:
+            STRUCT_UHALF.pack_into(page,off,value & 0xffff)
 
     def read_halfword(self,addr):
-        mem = self.read_memory(addr,2)
-        return struct.unpack('<h',mem)[0]
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        off = addr & PAGE_MASK
+        if page is None or off > PAGE_SIZE - 2:
+            return STRUCT_HALF.unpack(self.read_memory(addr,2))[0]
+        return STRUCT_HALF.unpack_from(page,off)[0]
 
     def write_byte(self,addr,value):
-        self.write_memory(addr,struct.pack('<b',ctypes.c_int8(value).value))
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None or page is ZERO_PAGE:
+            page = self.page(addr >> PAGE_SHIFT,True)
+        page[addr & PAGE_MASK] = value & 0xff
 
     def read_byte(self,addr):
-        mem = self.read_memory(addr,1)
-        return struct.unpack('<b',mem)[0]
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            page = self.page(addr >> PAGE_SHIFT,False)
+        b = ord(page[addr & PAGE_MASK]) if page is ZERO_PAGE else page[addr & PAGE_MASK]
+        return b - 0x100 if b & 0x80 else b
+
+    def views(self,addr,length,write=False):
+        # yield views of the memory holding 'length' bytes at 'addr', one
+        # per page, so that data can be copied in or out in bulk; views
+        # for writing allocate the pages they cover
+        end = addr + length
+        if addr < 0 < length:
+            self.page(-1,write)
+        while addr < end:
+            page = self.page(addr >> PAGE_SHIFT,write)
+            off = addr & PAGE_MASK
+            n = min(PAGE_SIZE - off,end - addr)
+            yield memoryview(page)[off:off+n]
+            addr += n
+
+    def string_at(self,addr):
+        # return a read-only view of the null-terminated string at an
+        # address in main memory (without its terminator); the view
+        # shares the memory so it must be used before memory changes;
+        # only a string that spans pages is copied
+        if addr < 0:
+            self.page(-1,False)
+        pieces = []
+        while True:
+            page = self.page(addr >> PAGE_SHIFT,False)
+            off = addr & PAGE_MASK
+            end = page.find('\x00',off)
+            if end != -1:
+                pieces.append(buffer(page,off,end - off))
+                break
+            pieces.append(buffer(page,off))
+            addr += PAGE_SIZE - off
+        if len(pieces) == 1:
+            return pieces[0]
+        return buffer("".join(str(p) for p in pieces))
+
+    def snapshot(self):
+        # capture the contents of memory; untouched pages are not copied
+        return (self.brk,self.brkMax,
+                dict((n,p if p is ZERO_PAGE else str(p)) for n, p in self.pages.iteritems()))
+
+    def restore(self,state):
+        self.brk, self.brkMax, pages = state
+        self.pages.clear()
+        for n, p in pages.iteritems():
+            self.pages[n] = p if p is ZERO_PAGE else bytearray(p)
+
+    def usage(self):
+        # report the size of each region along with the number of bytes
+        # of it held in pages that have been written to, the largest the
+        # heap has been and the deepest the stack has grown
+        written = [n << PAGE_SHIFT for n, p in self.pages.iteritems() if p is not ZERO_PAGE]
+        heap = (self.dataSize + PAGE_MASK) & ~PAGE_MASK
+        stack = [addr for addr in written if addr >= self.stackBottom]
+        return collections.OrderedDict([
+            ('data size',self.dataSize),
+            ('data resident',sum(PAGE_SIZE for addr in written if addr < heap)),
+            ('heap size',self.brk - self.dataSize),
+            ('heap resident',sum(PAGE_SIZE for addr in written if heap <= addr < self.stackBottom)),
+            ('heap high-water',self.brkMax - self.dataSize),
+            ('stack size',self.size - self.stackBottom),
+            ('stack resident',len(stack) * PAGE_SIZE),
+            ('stack high-water',self.size - min(stack) if stack else 0)])
+
+class MIPSError(Exception):
+    # raised for an error in the source of a program ('line' is the
+    # source line it was found on) or one that stops a program; the
+    # process ends with exit status 'status' if the error is reported
+    # (see runtime_error)
+    def __init__(self,msg,line=None,status=1):
+        Exception.__init__(self,msg if line is None else "line {0}: {1}".format(line,msg))
+        self.msg = msg
+        self.line = line
+        self.status = status
+
+class MIPSBreak(Exception):
+    # raised to pause a running simulation (see MIPSSimulator.run_until);
+    # an instance also stands in for an input file that pauses the
+    # simulation as soon as the program tries to read from it
+    def readline(self):
+        raise self
+
+class MIPSSimulator:
+    def __init__(self,f,system=None,stackSize=STACK_SPACE,memorySize=MEMORY_SIZE):
+        # load the program from an executable file (or use an already
+        # loaded MIPSProgram); this consists of the program's text
+        # instructions and its data segment memory; system calls are
+        # handled by 'system' (which uses stdin/stdout by default)
+        self.program = f if isinstance(f,MIPSProgram) else MIPSProgram.load(f)
+        self.instr = self.program.instr
+        self.system = MIPSSystem() if system is None else system
+
+        # create main memory holding the data segment, the heap and a
+        # stack of 'stackSize' bytes at the top of an address space of
+        # 'memorySize' bytes; memory is accessed through the accessors
+        # of the memory object itself
+        self.memory = MIPSMemory(self.program.data,stackSize,memorySize)
+        for name in ('read_memory','write_memory','read_word','write_word','read_halfword',
+                     'write_halfword','read_byte','write_byte','string_at'):
+            setattr(self,name,getattr(self.memory,name))
+
+        # allocate registers as a list of integers; each register has a
+        # constant index into this list (its offset in MIPS_REGISTERS
+        # divided by the size of a word); every register always holds
+        # a signed 32-bit value
+        self.registers = [0] * REG_COUNT
+
+        # position the stack pointer register at the top of the stack
+        self.write_register('$sp',self.memory.size)
+
+        # create the program counter (this is the offset within the
+        # list of instructions of the next instruction to execute)
+        self.progCounter = 0
+
+        # each instruction is decoded once into an operation bound to
+        # this simulator; this happens the first time the instruction
+        # executes so that instructions that never run (or that are
+        # replaced by translated code) are never decoded; the offset
+        # just past the last instruction holds an operation that fails
+        # so that falling off the end of the program needs no check
+        # (see 'decode_lazy' for branches and jumps); instructions
+        # with the same operands share one operation (see 'ops')
+        self.code = [self.decode_lazy] * len(self.instr) + [self.fell_through]
+        self.ops = {}
+
+        # tiered execution and fusion are off until 'enable_tiering' or
+        # 'enable_fusion' is called; both translate instructions on
+        # demand; statistics are reported by 'report_stats'
+        self.hotThreshold = None
+        self.fusion = False
+        self.translator = None
+        self.translated = set()   # offsets whose operation is translated code
+        self.groups = {}          # fused groups by their source (see 'fused')
+        self.stats = collections.OrderedDict()
+
+        # profiling is off until 'enable_profiling' is called
+        self.counts = None
+        self.syscalls = None
+
+        # the simulation runs in blocks of at most LIMIT_STEPS
+        # instructions; the number of instructions retired (as of the
+        # last block) and any limits are checked between blocks (see
+        # 'set_limits')
+        self.retired = 0
+        self.maxInstructions = None
+        self.timeout = None
+        self.deadline = None
+
+    def decode(self,parts):
+        # turn an instruction (as produced by the assembler) into an
+        # operation with its operands already resolved
+        a, b, c, imm = decode_operands(parts)
+        return MIPS_DECODERS[parts[0]](self,a,b,c,imm)
+
+    def decode_lazy(self,pc):
+        # stands in for an operation that has not been decoded yet
+        if self.fusion:
+            end = self.fused(pc)
+            if end is not None:
+                # groups of the same instructions share their code
+                source = self.translator.group_source(pc,end)
+                block = self.groups.get(source)
+                if block is None:
+                    block = self.groups[source] = self.bind(self.translator.compile(source))
+                self.code[pc] = block
+                self.translated.add(pc)
+                self.stats['fusions'] += 1
+                return block(pc)
+        name, a, b, c, imm = self.instr.op(pc)
+        jump = name in MIPS_BRANCHES or name in ('j','jal')
+        target = imm
+        if jump and 0 <= target < len(self.instr):
+            # the operation reads the target from the program when the
+            # branch is taken (see decode_semantics)
+            imm = None
+        op = self.ops.get((name,a,b,c,imm))
+        if op is None:
+            op = self.ops[(name,a,b,c,imm)] = MIPS_DECODERS[name](self,a,b,c,imm)
+        if jump and imm is not None:
+            # a branch or jump outside of the program fails when it is
+            # taken; 'jr' and 'jalr' check their target themselves
+            op = self.bad_target(op,target)
+        if self.hotThreshold is not None and (name in MIPS_BRANCHES or name == 'j') and target <= pc:
+            op = self.count_backedge(op,pc,target)
+        if self.syscalls is not None and name == 'syscall':
+            op = self.time_syscall(op)
+        self.code[pc] = op
+        return op(pc)
+
+    def bad_target(self,op,target):
+        # wrap the operation for a branch or jump to an offset outside
+        # of the program
+        def checked(pc):
+            nxt = op(pc)
+            if nxt == target:
+                self.bad_offset(pc,target)
+            return nxt
+        return checked
+
+    def fell_through(self,pc):
+        # stands in for the instruction after the last one
+        if pc == 0:
+            raise MIPSError("attempted to execute non-instruction: bad offset in program")
+        self.bad_offset(pc-1,pc)
+
+    def bad_offset(self,pc,target):
+        # stop the program because the instruction at 'pc' passed
+        # control to 'target', which is not an instruction
+        raise MIPSError("attempted to execute non-instruction: bad offset {0} in program, reached "
+                        "from {1}".format(target,self.where(pc)))
+
+    def fault(self,pc,msg):
+        # stop the program because the instruction at 'pc' (or the
+        # translated block starting there) failed
+        raise MIPSError("{0} {1} {2}".format(msg,"in the block starting at" if pc in self.translated
+                                             else "at",self.where(pc)))
+
+    def where(self,pc):
+        # describe an instruction for an error message
+        line = self.program.line(pc)
+        return "{0}{1} ({2})".format(self.program.location(pc),
+                                     "" if line is None else " on line {0}".format(line),
+                                     self.program.disassemble(pc) if 0 <= pc < len(self.instr)
+                                     else "no instruction")
+
+    def bind(self,code):
+        # run translated code and bind what it defines to this
+        # simulator (see TRANSLATION_BIND)
+        namespace = {}
+        exec code in namespace
+        return namespace['bind'](self.registers,self.read_word,self.read_halfword,self.read_byte,
+                                 self.write_word,self.write_halfword,self.write_byte,
+                                 self.decode(['syscall']),self.memory.pages.get,
+                                 STRUCT_WORD.unpack_from,STRUCT_UWORD.pack_into,ZERO_PAGE,
+                                 self.bad_offset,self.instr.imms)
+
+    def install_translation(self,code,wrap=None):
+        # bind the translated code to this simulator; each function
+        # replaces the operation for the instruction that starts the
+        # block(s) it runs; 'wrap' may be used to wrap the functions
+        blocks = self.bind(code)
+        wrapped = {}
+        self.translated.update(blocks)
+        for pc, block in blocks.iteritems():
+            if wrap is not None:
+                if block not in wrapped:
+                    wrapped[block] = wrap(block)
+                block = wrapped[block]
+            self.code[pc] = block
+
+    def enable_fusion(self):
+        # run each group of adjacent instructions that matches one of
+        # MIPS_FUSIONS as one operation, translated from the group the
+        # first time it executes; the other instructions of a group
+        # keep operations of their own so that a branch into the
+        # middle of a group works as usual; a group counts as one
+        # instruction (like translated code) so this cannot be
+        # combined with profiling, tiering or an instruction limit
+        self.fusion = True
+        if self.translator is None:
+            self.translator = MIPSTranslator(self.instr)
+        self.stats['fusions'] = 0
+
+    def fused(self,pc):
+        # return the end of the group of instructions to fuse that
+        # starts at 'pc' (or None); a group never loops back to its
+        # own start so that it always returns to the simulation; a
+        # group that ends in a system call starts with a 'li' or a
+        # 'move', which give the same result when run twice, so that
+        # the group can simply run again if the system call pauses it
+        # (see MIPSBreak)
+        op = self.instr.op
+        names = tuple(MIPS_ALIASES.get(MIPS_OPCODES[x],MIPS_OPCODES[x]) for x in self.instr.opcodes[pc:pc+3])
+        for end in (pc+3,pc+2):
+            if len(names) >= end-pc and names[:end-pc] in MIPS_FUSIONS:
+                name, imm = op(end-1)[0], op(end-1)[4]
+                if (name in MIPS_BRANCHES or name == 'j') and imm == pc:
+                    continue
+                return end
+        return None
+
+    def enable_tiering(self,threshold=HOT_THRESHOLD):
+        # count how many times each backward branch is taken; once a
+        # loop has been taken 'threshold' times its body is compiled
+        # into a Python function that runs until the loop is left
+        self.hotThreshold = threshold
+        self.backedges = {}
+        self.stats['hot threshold'] = threshold
+        self.stats['loops compiled'] = 0
+        self.stats['instructions compiled'] = 0
+        self.stats['time compiling'] = 0.0
+        self.stats['time in compiled code'] = 0.0
+
+    def count_backedge(self,op,pc,target):
+        # wrap the operation for a backward branch so that it counts
+        # how often it is taken
+        counts = self.backedges
+        threshold = self.hotThreshold
+        def counter(pc):
+            nxt = op(pc)
+            if nxt == target:
+                n = counts[pc] = counts.get(pc,0) + 1
+                if n == threshold:
+                    self.compile_loop(target,pc)
+            return nxt
+        return counter
+
+    def compile_loop(self,start,end):
+        # compile the instructions between a loop's start and its
+        # backward branch and install the result for every block in
+        # the loop
+        begin = time.time()
+        if self.translator is None:
+            self.translator = MIPSTranslator(self.instr)
+        code = self.translator.compile(self.translator.region_source(start,end))
+        stats = self.stats
+        def wrap(region):
+            def timed(pc):
+                t = time.time()
+                try:
+                    return region(pc)
+                finally:
+                    stats['time in compiled code'] += time.time() - t
+            return timed
+        self.install_translation(code,wrap)
+        stats['loops compiled'] += 1
+        stats['instructions compiled'] += end - start + 1
+        stats['time compiling'] += time.time() - begin
+
+    def set_limits(self,maxInstructions=None,timeout=None):
+        # stop the program once it has retired 'maxInstructions'
+        # instructions or once 'timeout' seconds have passed from now;
+        # the limits are only checked between blocks of instructions
+        # so that they cost nothing per instruction; note that a
+        # translated block counts as one instruction and is never
+        # interrupted
+        self.maxInstructions = maxInstructions
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.time() + timeout
+
+    def next_block(self,pc,steps):
+        # account for a block of 'steps' instructions that has just run
+        # and return the number of instructions the next block may run
+        self.retired += steps
+        left = LIMIT_STEPS
+        if self.maxInstructions is not None:
+            left = min(left,self.maxInstructions - self.retired)
+            if left <= 0:
+                self.limit_reached(pc,"instruction limit of {0} reached".format(self.maxInstructions))
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.limit_reached(pc,"time limit of {0:g}s reached".format(self.timeout))
+        return left
+
+    def limit_reached(self,pc,msg):
+        # stop the program with a distinct exit status
+        raise MIPSError("{0}: {1} instructions retired; stopped at {2}".format(
+            msg,self.retired,self.where(pc)),status=LIMIT_STATUS)
+
+    def enable_profiling(self):
+        # count how many times each instruction executes and time each
+        # system call by service; this must be called before any
+        # instruction has executed; 'simulation' then runs a separate
+        # loop that does the counting
+        self.counts = [0] * len(self.code)
+        self.syscalls = {}
+
+    def time_syscall(self,op):
+        # wrap the operation for a system call so that it records the
+        # number of calls and the time spent per service
+        registers = self.registers
+        syscalls = self.syscalls
+        clock = time.time
+        def timed(pc):
+            v = registers[REG_V0]
+            t = clock()
+            try:
+                return op(pc)
+            finally:
+                entry = syscalls.setdefault(v,[0,0.0])
+                entry[0] += 1
+                entry[1] += clock() - t
+        return timed
+
+    def profile(self):
+        # gather the profile as a dictionary: the number of instructions
+        # retired in total, per opcode and per instruction (with the
+        # source line and location of each) and the calls and time
+        # per system call service
+        opcodes = collections.Counter()
+        instrs = []
+        ids = self.instr.opcodes
+        for pc, count in enumerate(self.counts[:len(self.instr)]):
+            if count > 0:
+                opcodes[MIPS_OPCODES[ids[pc]]] += count
+                instrs.append(collections.OrderedDict([
+                    ('pc',pc),('line',self.program.line(pc)),('location',self.program.location(pc)),
+                    ('instruction',self.program.disassemble(pc)),('count',count)]))
+        instrs.sort(key=lambda x: (-x['count'],x['pc']))
+        syscalls = collections.OrderedDict()
+        for v in sorted(self.syscalls):
+            calls, seconds = self.syscalls[v]
+            syscalls[SYSCALL_NAMES.get(v,str(v))] = collections.OrderedDict([('calls',calls),
+                                                                              ('time',seconds)])
+        return collections.OrderedDict([('instructions',sum(self.counts)),
+                                        ('opcodes',collections.OrderedDict(opcodes.most_common())),
+                                        ('pcs',instrs),('syscalls',syscalls)])
+
+    def report_profile(self,f,profile=None):
+        # write a report of the profile sorted by how often things
+        # executed; only the PROFILE_TOP most frequent instructions
+        # are listed
+        if profile is None:
+            profile = self.profile()
+        total = profile['instructions'] or 1
+        f.write("pymips: profile: {0} instructions retired\n".format(profile['instructions']))
+        f.write("\n{0:<10} {1:>12} {2:>8}\n".format('opcode','count','percent'))
+        for name, count in profile['opcodes'].iteritems():
+            f.write("{0:<10} {1:>12} {2:>7.2f}%\n".format(name,count,100.0 * count / total))
+        f.write("\n{0:>6} {1:<20} {2:>12} {3:>8}  {4}\n".format('line','location','count',
+                                                               'percent','instruction'))
+        for entry in profile['pcs'][:PROFILE_TOP]:
+            f.write("{0:>6} {1:<20} {2:>12} {3:>7.2f}%  {4}\n".format(
+                '?' if entry['line'] is None else entry['line'],entry['location'],entry['count'],
+                100.0 * entry['count'] / total,entry['instruction']))
+        if profile['syscalls']:
+            f.write("\n{0:<16} {1:>8} {2:>10}\n".format('system call','calls','time'))
+            for name, entry in profile['syscalls'].iteritems():
+                f.write("{0:<16} {1:>8} {2:>9.3f}s\n".format(name,entry['calls'],entry['time']))
+
+    def report_stats(self,f):
+        stats = self.stats.copy()
+        stats.update(self.memory.usage())
+        for key, value in stats.iteritems():
+            if isinstance(value,float):
+                value = "{0:.3f}s".format(value)
+            f.write("pymips: {0}: {1}\n".format(key,value))
+
+    def write_register(self,reg,value):
+        self.write_register_at(MIPS_REGISTERS[reg],value)
+
+    def read_register(self,reg):
+        return self.read_register_at(MIPS_REGISTERS[reg])
+
+    def write_register_at(self,offset,value):
+        # each register is a 4-byte word; value should be a Python
+        # 'long/int' that we wrap into a signed word
+        self.registers[offset >> 2] = ((value + 0x80000000) & 0xffffffff) - 0x80000000
+
+    def read_register_at(self,offset):
+        # the result is a Python 'long/int'
+        return self.registers[offset >> 2]
 
     def read_string(self,addr):
-        s = ""
+        return str(self.string_at(addr))
+
+    def simulation(self):
+        # run the simulation; each operation returns the offset of the
+        # next instruction so the loop only has to fetch and dispatch
+        if self.counts is not None:
+            return self.simulation_profiled()
+        code = self.code
+        pc = self.progCounter
+        repeat = itertools.repeat
+        try:
+            steps = self.next_block(pc,0)
+            while True:
+                for _ in repeat(None,steps):
+                    pc = code[pc](pc)
+                steps = self.next_block(pc,steps)
+        except (MIPSBreak,MIPSError):
+            raise
+        except Exception as e:
+            self.fault(pc,e)
+        finally:
+            self.progCounter = pc
+            self.system.flush()
+
+    def simulation_profiled(self):
+        # the same as 'simulation' but counts each instruction as it
+        # is executed (see 'enable_profiling')
+        code = self.code
+        counts = self.counts
+        pc = self.progCounter
+        repeat = itertools.repeat
+        try:
+            steps = self.next_block(pc,0)
+            while True:
+                for _ in repeat(None,steps):
+                    counts[pc] += 1
+                    pc = code[pc](pc)
+                steps = self.next_block(pc,steps)
+        except (MIPSBreak,MIPSError):
+            raise
+        except Exception as e:
+            self.fault(pc,e)
+        finally:
+            self.progCounter = pc
+            self.system.flush()
+
+    def run_until(self,pc=None):
+        # run the simulation until just before the instruction at
+        # offset 'pc' would execute or, by default, until the program
+        # first asks for input; the simulation may then be resumed by
+        # 'simulation'; if the program exits first then SystemExit is
+        # raised as usual; note that translated code does not stop
+        # in the middle of a block
+        system = self.system
+        infile = system.infile
+        if pc is None:
+            system.infile = MIPSBreak()
+        else:
+            op = self.code[pc]
+            def stop(pc):
+                raise MIPSBreak()
+            self.code[pc] = stop
+        try:
+            self.simulation()
+        except MIPSBreak:
+            pass
+        finally:
+            system.infile = infile
+            if pc is not None:
+                self.code[pc] = op
+
+    def step(self,count=1):
+        # execute the next 'count' instructions (a translated block
+        # counts as one); the simulation may then be resumed by 'step'
+        # or 'simulation'; if the program exits first then SystemExit
+        # is raised as usual; the limits (see 'set_limits') are checked
+        # before every block of instructions like in 'simulation'
+        code = self.code
+        counts = self.counts
+        pc = self.progCounter
+        retired = self.retired
+        repeat = itertools.repeat
+        try:
+            while count > 0:
+                self.retired = retired
+                steps = min(count,self.next_block(pc,0))
+                count -= steps
+                for _ in repeat(None,steps):
+                    if counts is not None:
+                        counts[pc] += 1
+                    pc = code[pc](pc)
+                    retired += 1
+        except (MIPSBreak,MIPSError):
+            raise
+        except Exception as e:
+            self.fault(pc,e)
+        finally:
+            self.progCounter = pc
+            self.retired = retired
+            self.system.flush()
+
+    def reset(self,system=None):
+        # return the simulator to the state the program starts in so
+        # that it can be run again (by default with the same system);
+        # memory and the decoded (or translated) operations are reused;
+        # any profile is cleared but statistics (see 'report_stats')
+        # keep accumulating across runs
+        if system is not None:
+            self.system = system
+        self.memory.reset(self.program.data)
+        self.registers[:] = [0] * REG_COUNT
+        self.write_register('$sp',self.memory.size)
+        self.progCounter = 0
+        self.retired = 0
+        self.set_limits(self.maxInstructions,self.timeout)
+        if self.counts is not None:
+            self.counts[:] = [0] * len(self.counts)
+            self.syscalls.clear()
+
+    def snapshot(self):
+        # capture the state of the simulation: registers, memory, the
+        # program counter, the number of instructions retired and any
+        # input the system has buffered (but not what has been written
+        # already); the state can be restored into this or any other
+        # simulator of the same program by 'restore'
+        system = self.system
+        return (list(self.registers),self.memory.snapshot(),self.progCounter,self.retired,
+                system.buf[system.pos:])
+
+    def restore(self,state):
+        # restore a state captured by 'snapshot'; registers and memory
+        # are updated in place since decoded operations hold on to them
+        registers, memory, self.progCounter, self.retired, self.system.buf = state
+        self.system.pos = 0
+        self.registers[:] = registers
+        self.memory.restore(memory)
+
+class MIPSTranslator:
+    # converts a program's instructions into Python source; registers
+    # are kept in local variables and written back to the register
+    # file whenever control leaves the generated code; generated
+    # functions take and return instruction offsets just like decoded
+    # operations so they can stand in for the operation at the start
+    # of any basic block; system calls are left to the decoded
+    # operations
+
+    def __init__(self,instr):
+        # basic blocks are found only when they are needed so that
+        # translating a few instructions of a large program stays
+        # cheap; operands are read from the program's columns
+        self.instr = instr
+        self.leaders = None
+
+    def op(self,pc):
+        # return the name and operands of an instruction (see
+        # MIPSInstructions.op)
+        return self.instr.op(pc)
+
+    def find_leaders(self):
+        # find the offsets that start a basic block: the entry point,
+        # branch/jump targets and anything following a branch, jump
+        # or system call (system calls are blocks of their own)
+        n = len(self.instr)
+        leaders = set([0])
+        for pc in xrange(n):
+            name, a, b, c, imm = self.op(pc)
+            if name in MIPS_BRANCHES or name in ('j','jal'):
+                leaders.add(imm)
+            if name in MIPS_BRANCHES or name in MIPS_JUMPS or name == 'syscall':
+                leaders.add(pc+1)
+            if name == 'syscall':
+                leaders.add(pc)
+        return sorted(l for l in leaders if 0 <= l < n)
+
+    def blocks(self,start=0,end=None):
+        # generate (start,end) pairs for the basic blocks that begin
+        # in the range [start,end); system calls are skipped
+        if self.leaders is None:
+            self.leaders = self.find_leaders()
+        leaders = self.leaders
+        if end is None:
+            end = len(self.instr)
+        i = bisect.bisect_left(leaders,start)
+        while i < len(leaders) and leaders[i] < end:
+            first = leaders[i]
+            i += 1
+            last = leaders[i] if i < len(leaders) else len(self.instr)
+            if self.op(first)[0] != 'syscall':
+                yield first, last
+
+    def source(self,blocks=None):
+        # generate a module that defines 'bind'; it takes the register
+        # file, memory accessors and the system call operation and
+        # returns a mapping of leader offsets to functions; here each
+        # basic block (or each of the given (start,end) ranges) becomes
+        # its own function
+        lines = [TRANSLATION_BIND,"    blocks = {}"]
+        for start, end in self.blocks() if blocks is None else blocks:
+            lines.extend("    " + l for l in self.block(start,end))
+            lines.append("    blocks[{0}] = b{0}".format(start))
+        lines.append("    return blocks")
+        return "\n".join(lines) + "\n"
+
+    def group_source(self,start,end):
+        # generate a module like 'source' for the single block in
+        # [start,end) whose 'bind' returns its function; the code does
+        # not depend on where the block is (offsets are relative to
+        # the function's argument and targets are read from the
+        # program) so the same instructions elsewhere can share it
+        lines = [TRANSLATION_BIND]
+        lines.extend("    " + l for l in self.block(start,end,start))
+        lines.append("    return block")
+        return "\n".join(lines) + "\n"
+
+    def region_source(self,start,end):
+        # generate a module like 'source' for a single function that
+        # runs all the blocks in [start,end] (e.g. a loop body) until
+        # control leaves them
+        blocks = list(self.blocks(start,end+1))
+        lines = [TRANSLATION_BIND]
+        lines.extend("    " + l for l in self.region(blocks))
+        lines.append("    return dict.fromkeys({0},region)".format([first for first, _ in blocks]))
+        return "\n".join(lines) + "\n"
+
+    def compile(self,source=None):
+        return compile(source or self.source(),'<pymips translation>','exec')
+
+    def usage(self,ranges):
+        # determine which registers the instructions in the given
+        # ranges read and write
+        reads = set()
+        writes = set()
+        for start, end in ranges:
+            for pc in xrange(start,end):
+                r, w = MIPSTranslator.op_usage(self.op(pc))
+                reads |= r
+                writes |= w
+        return reads, writes
+
+    @staticmethod
+    def op_usage(op):
+        # determine which registers a single instruction reads and
+        # writes; system calls are treated as using no registers
+        name, a, b, c, imm = op
+        reads = set()
+        writes = set()
+        if name in ('div','divu','mult','multu'):
+            writes.update((REG_HI,REG_LO))
+        elif name == 'mthi':
+            writes.add(REG_HI)
+        elif name == 'mtlo':
+            writes.add(REG_LO)
+        elif name in ('jal','jalr'):
+            writes.add(REG_RA)
+        elif name not in MIPS_BRANCHES and name not in ('j','jr','nop','sb','sh','sw','syscall'):
+            # 'a' is the destination register
+            writes.add(a)
+            if name == 'mfhi':
+                reads.add(REG_HI)
+            elif name == 'mflo':
+                reads.add(REG_LO)
+            elif name not in ('lhi','llo'):
+                a = None
+        reads.update(x for x in (a,b,c) if x is not None)
+        return reads, writes
+
+    @staticmethod
+    def fields(op):
+        # build the replacement fields for an instruction's template
+        name, a, b, c, imm = op
+        fields = {'a':TRANSLATION_LOCAL.format(a) if a is not None else None,
+                  'b':TRANSLATION_LOCAL.format(b) if b is not None else None,
+                  'c':TRANSLATION_LOCAL.format(c) if c is not None else imm,
+                  'imm':imm,'hi':TRANSLATION_LOCAL.format(REG_HI),'lo':TRANSLATION_LOCAL.format(REG_LO)}
+        if imm is not None:
+            fields['imms'] = ((imm + 0x80000000) & 0xffffffff) - 0x80000000
+            fields['immu'] = imm & 0xffffffff
+            fields['immw'] = imm + 0x80000000
+            fields['addr'] = imm if b is None else "({0} + {1})".format(imm,fields['b'])
+        return fields
+
+    @staticmethod
+    def statements(op):
+        # generate the statements for an instruction that does not
+        # transfer control
+        name, a, b, c, imm = op
+        return semantics(name,b).format(**MIPSTranslator.fields(op)).split('; ')
+
+    @staticmethod
+    def offset(pc,base=None):
+        # an offset in generated code; with 'base' it is relative to
+        # the function's argument, which is then the offset 'base'
+        if base is None:
+            return str(pc)
+        return "pc + {0}".format(pc - base) if pc != base else "pc"
+
+    def target(self,pc,imm,base=None):
+        # the offset a branch or jump at 'pc' passes control to; one
+        # outside of the program fails (see MIPSSimulator.decode_lazy)
+        if 0 <= imm < len(self.instr):
+            return str(imm) if base is None else "t[{0}]".format(self.offset(pc,base))
+        return "bo({0},{1})".format(self.offset(pc,base),imm)
+
+    def indirect(self,pc,a,base=None):
+        # the offset 'jr'/'jalr' at 'pc' passes control to, which is
+        # checked as it executes (see decode_jalr)
+        return "{0} if {0} & 0xffffffff < {1} else bo({2},{0})".format(TRANSLATION_LOCAL.format(a),
+                                                                 len(self.instr),self.offset(pc,base))
+
+    def block(self,start,end,base=None):
+        # generate the function for the block of instructions in the
+        # range [start,end); a block that branches back to its own
+        # start loops without returning to the simulation; with
+        # 'base' the function is named 'block' and its offsets are
+        # relative (see 'offset')
+        at = lambda pc: self.offset(pc,base)
+        reads, writes = self.usage([(start,end)])
+        local = TRANSLATION_LOCAL.format
+        writeback = ["r[{0}] = {1}".format(x,local(x)) for x in sorted(writes)]
+
+        body = []
+        loop = False
+        last = self.op(end-1)[0]
+        for pc in range(start,end):
+            name, a, b, c, imm = self.op(pc)
+            if name in MIPS_BRANCHES:
+                cond = MIPS_BRANCHES[name].format(**self.fields(self.op(pc)))
+                if imm == start:
+                    loop = True
+                    body += ["if {0}:".format(cond),"    continue"] + writeback
+                else:
+                    body += writeback + ["if {0}:".format(cond),"    return {0}".format(self.target(pc,imm,base))]
+                body.append("return {0}".format(at(pc+1)))
+            elif name == 'j':
+                if imm == start:
+                    loop = True
+                    body.append("continue")
+                else:
+                    body += writeback + ["return {0}".format(self.target(pc,imm,base))]
+            elif name == 'jal':
+                body += ["{0} = {1}".format(local(REG_RA),at(pc+1))] + writeback
+                body.append("return {0}".format(self.target(pc,imm,base)))
+            elif name == 'jalr':
+                body += ["{0} = {1}".format(local(REG_RA),at(pc+1))] + writeback
+                body.append("return {0}".format(self.indirect(pc,a,base)))
+            elif name == 'jr':
+                body += writeback + ["return {0}".format(self.indirect(pc,a,base))]
+            elif name == 'syscall':
+                # only ever ends a fused group (see MIPSSimulator.fused)
+                body += writeback + ["return sc({0})".format(at(pc))]
+            else:
+                body.extend(self.statements(self.op(pc)))
+        if last not in MIPS_BRANCHES and last not in MIPS_JUMPS and last != 'syscall':
+            # fall through to the next block
+            body += writeback + ["return {0}".format(at(end))]
+
+        lines = ["def {0}(pc):".format("b{0}".format(start) if base is None else "block")]
+        lines.extend("    {0} = r[{1}]".format(local(x),x) for x in sorted(reads))
+        if loop:
+            lines.append("    while True:")
+            lines.extend("        " + l for l in body)
+        else:
+            lines.extend("    " + l for l in body)
+        return lines
+
+    def region(self,blocks):
+        # generate one function that runs the given blocks; it selects
+        # the block to run by the current offset and returns as soon
+        # as the offset leaves the region
+        reads, writes = self.usage(blocks)
+        local = TRANSLATION_LOCAL.format
+        lines = ["def region(pc):"]
+        lines.extend("    {0} = r[{1}]".format(local(x),x) for x in sorted(reads | writes))
+        lines.append("    while True:")
+        for i, (start, end) in enumerate(blocks):
+            lines.append("        {0} pc == {1}:".format('elif' if i else 'if',start))
+            body = []
+            for pc in range(start,end):
+                name, a, b, c, imm = self.op(pc)
+                if name in MIPS_BRANCHES:
+                    cond = MIPS_BRANCHES[name].format(**self.fields(self.op(pc)))
+                    body.append("pc = {0} if {1} else {2}".format(self.target(pc,imm),cond,pc+1))
+                elif name == 'j':
+                    body.append("pc = {0}".format(self.target(pc,imm)))
+                elif name == 'jal':
+                    body += ["{0} = {1}".format(local(REG_RA),pc+1),"pc = {0}".format(self.target(pc,imm))]
+                elif name == 'jalr':
+                    body += ["{0} = {1}".format(local(REG_RA),pc+1),"pc = {0}".format(self.indirect(pc,a))]
+                elif name == 'jr':
+                    body.append("pc = {0}".format(self.indirect(pc,a)))
+                else:
+                    body.extend(self.statements(self.op(pc)))
+            last = self.op(end-1)[0]
+            if last not in MIPS_BRANCHES and last not in MIPS_JUMPS:
+                body.append("pc = {0}".format(end))
+            lines.extend("            " + l for l in body)
+        lines.append("        else:")
+        lines.extend("            r[{0}] = {1}".format(x,local(x)) for x in sorted(writes))
+        lines.append("            return pc")
+        return lines
+
+    @staticmethod
+    def cached(instr,content,path):
+        # return the code object for a program's translation; if
+        # 'path' is given then the code object is cached there and
+        # only regenerated if the executable's content changed
+        key = hashlib.sha1(content).digest()
+        header = imp.get_magic() + struct.pack('<i',TRANSLATION_VERSION) + key
+        if path is not None:
+            try:
+                with open(path,'rb') as f:
+                    if f.read(len(header)) == header:
+                        return marshal.load(f)
+            except (IOError,OSError,EOFError,ValueError,TypeError):
+                pass
+
+        code = MIPSTranslator(instr).compile()
+        if path is not None:
+            # write the cache file atomically so that concurrent runs
+            # never see a partial file; failing to write the cache is
+            # not an error
+            tmp = "{0}.{1}.tmp".format(path,os.getpid())
+            try:
+                with open(tmp,'wb') as f:
+                    f.write(header)
+                    marshal.dump(code,f)
+                if os.name == 'nt' and os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp,path)
+            except (IOError,OSError):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return code
+
+class MIPSOptimizer(MIPSTranslator):
+    # rewrites the instructions of a program before it is written out
+    # (see MIPSParser.optimize); within each basic block constants are
+    # folded through chains of 'li', 'addi' and the like, copies made
+    # by 'move' are propagated and writes that are never read are
+    # dropped along with 'nop's; jumps to jumps are threaded and code
+    # that no label or fall-through reaches is dropped; the program
+    # behaves exactly as before (registers are simply never observed
+    # in between system calls)
+
+    # instructions that only compute their destination register from
+    # their operands; shifts only count with an immediate amount
+    # since shifting by a negative amount fails
+    PURE = frozenset(('add','addu','addi','addiu','and','andi','mul','mulu','nor','or','ori',
+                      'sll','sra','srl','sub','subu','xor','xori','slt','sltu','slti','sltiu',
+                      'la','li','lhi','llo','move','mfhi','mflo'))
+    SHIFTS = frozenset(('sll','sra','srl'))
+    # registers read by system calls (see system_call)
+    SYSCALL_READS = frozenset(MIPS_REGISTERS[x] >> 2 for x in ('$v0','$a0','$a1','$a2'))
+
+    def __init__(self,instr,symbols,fixed=False):
+        # if 'fixed' is set (the program uses the offsets of its
+        # instructions as values, e.g. with 'la') then instructions
+        # are only rewritten in place and never dropped
+        MIPSTranslator.__init__(self,instr)
+        self.decoded = {}     # instructions rewritten so far
+        self.labels = sorted(set(addr for kind, addr in symbols.itervalues() if kind == 'text'))
+        self.fixed = fixed or self.uses_return_address()
+        self.dropped = set()
+        self.code = {}        # compiled templates used to fold constants
+
+    def uses_return_address(self):
+        # whether a return address is used as anything but the target
+        # of 'jr' or 'jalr' (its value is the offset of an instruction);
+        # it is followed from '$ra' through copies made by 'move' and
+        # through stack slots ('sw' then 'lw' with the same offset from
+        # '$sp'); a copy stored anywhere else may be loaded by any 'lw'
+        n = len(self.instr)
+        copies = set([REG_RA])
+        slots = set()
         while True:
-            bu = self.read_byte(addr)
-            if bu == 0:
+            found = len(copies), len(slots)
+            for pc in xrange(n):
+                name, a, b, c, imm = self.op(pc)
+                if name == 'move' and b in copies:
+                    copies.add(a)
+                elif name == 'sw' and a in copies:
+                    slots.add((b,imm) if b == REG_SP else None)
+                elif name == 'lw' and ((b,imm) in slots or None in slots):
+                    copies.add(a)
+            if (len(copies),len(slots)) == found:
                 break
-            s += chr(bu)
-            addr += 1
-        return s
+        for pc in xrange(n):
+            op = self.op(pc)
+            name, a, b, c, imm = op
+            reads = self.op_usage(op)[0]
+            if name == 'syscall':
+                reads |= self.SYSCALL_READS
+            elif name in ('jr','jalr','sw'):
+                reads.discard(a)
+            elif name == 'move':
+                reads.discard(b)
+            if reads & copies:
+                return True
+        return False
 
-    def simulation(self):
-        # run the simulation
+    def op(self,pc):
+        # rewritten instructions take the place of the originals
+        op = self.decoded.get(pc)
+        return op if op is not None else self.instr.op(pc)
+
+    def find_leaders(self):
+        # an instruction with a label may also be reached through an
+        # address computed at runtime (e.g. 'jr')
+        leaders = set(MIPSTranslator.find_leaders(self))
+        leaders.update(l for l in self.labels if l < len(self.instr))
+        return sorted(leaders)
+
+    def optimize(self):
+        # return the offsets of the instructions that are kept; the
+        # kept instructions are found with 'op'
+        n = len(self.instr)
+        self.thread_jumps()
+        # '$zero' can be written (see MIPS_SEMANTICS) but it still always
+        # holds zero unless something other than zero is written to it
+        zero = True
+        for pc in xrange(n):
+            op = self.op(pc)
+            reads, writes = self.op_usage(op)
+            if 0 in writes and not (self.pure(op) and reads <= set([0]) and
+                                    self.evaluate(op,{0:0}) == 0):
+                zero = False
+                break
+        for start, end in self.blocks():
+            self.simplify(start,end,zero)
+        # dropping an instruction may leave others unread
         while True:
-            if self.progCounter >= len(self.instr):
-                runtime_error("attempted to execute non-instruction: bad offset in program")
-
-            # fetch current instruction; update program counter next
-            # in case a jump happens during execution of the
-            # instruction
-            i = self.instr[self.progCounter]
-            self.progCounter += 1
-            try:
-                MIPS_INSTRUCTIONS[i[0]](self,i[1:])
-            except Exception as e:
-                runtime_error(str(e))
+            dropped = len(self.dropped)
+            reads = self.reads()
+            for start, end in self.blocks():
+                self.remove_dead(start,end,reads)
+            if len(self.dropped) == dropped:
+                break
+        if not self.fixed:
+            self.remove_unreachable()
+        return [pc for pc in xrange(n) if pc not in self.dropped]
+
+    def reads(self):
+        # find the registers that any instruction that is kept reads
+        reads = set()
+        for pc in xrange(len(self.instr)):
+            if pc not in self.dropped:
+                op = self.op(pc)
+                reads |= self.op_usage(op)[0]
+                if op[0] == 'syscall':
+                    reads |= self.SYSCALL_READS
+        return reads
+
+    def drop(self,pc):
+        if not self.fixed:
+            self.dropped.add(pc)
+
+    def pure(self,op):
+        name, a, b, c, imm = op
+        return name in self.PURE and (name not in self.SHIFTS or c is None and 0 <= imm < 32)
+
+    def thread_jumps(self):
+        # make branches and jumps to a 'j' go straight to its target
+        n = len(self.instr)
+        for pc in xrange(n):
+            name, a, b, c, imm = self.op(pc)
+            if name in MIPS_BRANCHES or name in ('j','jal'):
+                target = imm
+                seen = set()
+                while 0 <= target < n and target not in seen and self.op(target)[0] == 'j':
+                    seen.add(target)
+                    target = self.op(target)[4]
+                if target != imm:
+                    self.decoded[pc] = (name,a,b,c,target)
+
+    def simplify(self,start,end,zero):
+        # fold constants and propagate copies forward through a block;
+        # 'consts' and 'copies' map registers to their known value and
+        # to another register holding the same value
+        consts = {0:0} if zero else {}
+        copies = {}
+        for pc in xrange(start,end):
+            op = self.op(pc)
+            name, a, b, c, imm = op
+            reads, writes = self.op_usage(op)
+            if copies and name not in ('lhi','llo','jalr'):
+                # read the register that was copied instead
+                if a in writes:
+                    op = (name,a,copies.get(b,b),copies.get(c,c),imm)
+                else:
+                    op = (name,copies.get(a,a),copies.get(b,b),copies.get(c,c),imm)
+                if op != self.op(pc):
+                    self.decoded[pc] = op
+                    reads, writes = self.op_usage(op)
+            if name == 'nop' or name == 'move' and op[1] == op[2]:
+                self.drop(pc)
+                continue
+            if self.pure(op) and all(x in consts for x in reads):
+                v = self.evaluate(op,consts)
+                if v is not None:
+                    if consts.get(a) == v:
+                        # the register already holds the value
+                        self.drop(pc)
+                        continue
+                    op = self.decoded[pc] = ('li',a,None,None,v)
+                    name = 'li'
+            for x in writes:
+                consts.pop(x,None)
+                copies.pop(x,None)
+                for y in [y for y, z in copies.iteritems() if z == x]:
+                    del copies[y]
+            if name in ('la','li') and op[2] is None:
+                consts[a] = self.evaluate(op,consts)
+            elif name == 'move':
+                copies[a] = op[2]
+
+    def evaluate(self,op,consts):
+        # compute the result of a pure instruction whose operands are
+        # known with its template (see MIPS_SEMANTICS); None if it
+        # fails or does not fit in a register
+        source = "\n".join(self.statements(op))
+        code = self.code.get(source)
+        if code is None:
+            code = self.code[source] = compile(source,'<pymips optimizer>','exec')
+        env = dict((TRANSLATION_LOCAL.format(x),consts[x]) for x in self.op_usage(op)[0])
+        try:
+            exec code in env
+        except (ArithmeticError,ValueError):
+            return None
+        v = env[TRANSLATION_LOCAL.format(op[1])]
+        if not -0x80000000 <= v <= 0x7fffffff:
+            return None
+        return v
+
+    def remove_dead(self,start,end,live):
+        # drop pure instructions whose result is overwritten before it
+        # is read; any register read anywhere may be read after the
+        # block
+        live = set(live)
+        for pc in xrange(end-1,start-1,-1):
+            if pc in self.dropped:
+                continue
+            op = self.op(pc)
+            reads, writes = self.op_usage(op)
+            if self.pure(op) and not writes & live:
+                self.drop(pc)
+                continue
+            live -= writes
+            live |= reads
+
+    def remove_unreachable(self):
+        # drop instructions that are not the target of a branch, jump
+        # or label and that the previous instruction cannot fall
+        # through to
+        n = len(self.instr)
+        roots = set([0])
+        roots.update(self.labels)
+        for pc in xrange(n):
+            name, a, b, c, imm = self.op(pc)
+            if name in MIPS_BRANCHES or name in ('j','jal'):
+                roots.add(imm)
+        reached = False
+        for pc in xrange(n):
+            reached = reached or pc in roots
+            if not reached:
+                self.dropped.add(pc)
+            elif self.op(pc)[0] in ('j','jr'):
+                reached = False
 
 class MIPSParser:
-    REGEX_DIRECTIVE = re.compile('(?:\s*#.*\n)*\s*\.([a-z]+)')
-    REGEX_LABEL = re.compile('(?:\s*#.*\n)*\s*([a-zA-Z0-9_$]+):')
-    REGEX_ANY = re.compile('(?:\s*#.*\n)*\s*([^#\n]*[^#\s])?\s*')
-    REGEXES = [(REGEX_DIRECTIVE,'directive'),(REGEX_LABEL,'label'),(REGEX_ANY,'any')]
+    # a token is a directive, a label or anything else (a statement or
+    # directive argument), preceded by any whitespace and comment lines
+    REGEX_TOKEN = re.compile(r'''(?:\s*\#.*(?:\n|\Z))*\s*
+                                 (?:\.(?P<directive>[a-z]+)
+                                   |(?P<label>[a-zA-Z0-9_$]+):
+                                   |(?P<any>[^#\n]*[^#\s])?\s*)''',re.X)
 
     def __init__(self,f):
-        self.content = f.read().replace("\r","")
-        self.globl = []   # store global symbol details
-        self.data = []    # store data segment details
-        self.instr = []   # store instruction details
+        self.globl = []       # store global symbol details
+        self.labels = {}      # map labels to their address
+        self.symbols = {}     # map labels to ('text'|'data',address)
+        self.memory = bytearray()  # contents of the data segment
+        self.text = bytearray()    # encoded instructions (see EXE_RECORD)
+        self.constants = []   # immediates too large for an instruction record
+        self.fixups = []      # instructions that may refer to labels defined later
+        self.count = 0        # number of instructions
+        self.lines = bytearray()   # source line of each instruction (see EXE_LINE)
+        self.addressed = False     # whether an instruction's offset is used as a value
+        self.optimized = None      # instruction counts before and after optimizing
+
+        # split the assembly code into directives, labels and
+        # everything else; the source is read a chunk of lines at a
+        # time and assembled as it goes so that only the output and
+        # the label table are kept in memory
+        self.preprocess(MIPSParser.tokens(f))
 
-        # try to split the assembly code into directives, labels and
-        # everything else
-        pos = 0
+    @staticmethod
+    def tokens(f):
+        # generate the tokens of a source file; no token spans a line
+        # so the file can be tokenized a chunk of whole lines at a time
         line = 1
-        things = []
-        while pos < len(self.content):
-            for regex, kind in MIPSParser.REGEXES:
-                m = regex.match(self.content,pos)
-                if m:
-                    break
-            if m is None:
-                error_on_line("bad input: '{0}'".format(self.content[pos:]),
-                              line)
-            lno = -1
-            while pos < m.end(0):
-                if self.content[pos] == "\n":
-                    line += 1
-                if pos == m.start(1):
-                    lno = line
-                pos += 1
-            if m.group(1) is not None:
-                things.append((m.group(1),kind,lno))
-        self.preprocess(things)
+        while True:
+            lines = f.readlines(STREAM_CHUNK)
+            if not lines:
+                break
+            chunk = "".join(lines).replace("\r","")
+            for token in MIPSParser.tokenize(chunk,line):
+                yield token
+            line += chunk.count("\n")
+
+    @staticmethod
+    def tokenize(content,line=1):
+        # generate (content,kind,line) tuples for each token in
+        # 'content' in a single pass; lines are counted in bulk
+        # between consecutive tokens
+        match = MIPSParser.REGEX_TOKEN.match
+        count = content.count
+        pos = 0
+        end = len(content)
+        while pos < end:
+            m = match(content,pos)
+            kind = m.lastgroup
+            if kind is not None:
+                start = m.start(kind)
+                line += count("\n",pos,start)
+                yield m.group(kind), kind, line
+                pos = start
+            line += count("\n",pos,m.end())
+            pos = m.end()
 
     def preprocess(self,things):
         # go through the things we just parsed; assign them meaning
-        # within the context of the program; labels are resolved to
-        # addresses at a later stage
+        # within the context of the program and emit them to the data
+        # or text segment
         mode = state = label = ''
         for content, kind, line in things:
             if kind == 'directive':
@@ -977,7 +2554,7 @@ class MIPSParser:
                         # parse a list of comma separated integers and
                         # assign a data entry
                         try:
-                            self.data.append((state,map(int,re.split('[,\s]+',content)),label,line))
+                            self.emit_data(state,map(int,re.split('[,\s]+',content)),label,line)
                         except ValueError:
                             error_on_line("'{0}' directive requires integer argument".format(state),line)
                     elif state in ['ascii','asciiz']:
@@ -986,10 +2563,10 @@ class MIPSParser:
                         # have to unpack the double-quoted string
                         if len(content) < 2 or content[0] != '"' or content[len(content)-1] != '"':
                             error_on_line("'{0}' directive requires character string argument".format(state),line)
-                        self.data.append((state,(content[1:len(content)-1],),label,line))
+                        self.emit_data(state,(content[1:len(content)-1],),label,line)
                     elif state == 'space':
                         try:
-                            self.data.append((state,(int(content),),label,line))
+                            self.emit_data(state,(int(content),),label,line)
                         except ValueError:
                             error_on_line("'space' directive requires integer allocation amount argument",line)
                     else:
@@ -1007,108 +2584,159 @@ class MIPSParser:
                     else:
                         # then 'content' is an instruction; instructions
                         # are split by whitespace and commas
-                        self.instr.append((re.split('[,\s]+',content),label,line))
+                        self.emit_instr(re.split('[,\s]+',content),label,line)
                 else:
                     error_on_line("cannot understand '{0}'".format(content),line)
 
                 # reset label and state
                 label = state = ''
 
-    def __repr__(self):
-        return "{0}\n{1}\n{2}\n".format(str(self.globl),
-                                        str(self.data),
-                                        str(self.instr))
-
-    def build_program(self,outfile):
+    def define(self,label,kind,addr,line):
+        # add a label to the table of symbols that maps to their final
+        # address within the program; if the label exists then fail
+        if label in self.labels:
+            error_on_line("label '{0}' is already in use".format(label),line)
+        self.labels[label] = addr
+        self.symbols[label] = (kind,addr)
+
+    def emit_data(self,kind,things,label,line):
+        # write a data entry to the data segment; the stack will be
+        # allocated at runtime after the data segment
+        if label != '':
+            self.define(label,'data',len(self.memory),line)
+        for thing in things:
+            if kind == 'byte':
+                bs = struct.pack("<b",thing)
+            elif kind == 'half':
+                bs = struct.pack("<h",thing)
+            elif kind == 'word':
+                bs = struct.pack("<i",thing)
+            elif kind == 'ascii':
+                # this kind has no zero byte terminator
+                s = MIPSParser.eval_string_literal(thing)
+                bs = struct.pack("{0}s".format(len(s)),s)
+            elif kind == 'asciiz':
+                # 'struct.pack' will pad a zero when size exceeds
+                # length of string
+                s = MIPSParser.eval_string_literal(thing)
+                bs = struct.pack("{0}s".format(len(s)+1),s)
+            elif kind == 'space':
+                # fill in space with zero bytes
+                bs = struct.pack("{0}b".format(thing),*([0]*thing))
+            self.memory += bs
+
+    def emit_instr(self,parts,label,line):
+        # write an instruction to the text segment; a label maps to
+        # the index of the instruction
+        if label != '':
+            self.define(label,'text',self.count,line)
+        self.count += 1
+        self.lines += EXE_LINE.pack(line)
+
+        # a label can only be used by a select few instructions; it
+        # only appears as the last argument also; a label that is not
+        # defined yet may still be defined later on so we leave a
+        # placeholder and check the instruction once all labels are
+        # known
+        if parts[0] in LABEL_INSTRS:
+            if parts[-1] in self.labels:
+                self.resolve(parts)
+            elif REGEX_SYMBOL.match(parts[-1]):
+                self.fixups.append((self.count-1,parts,line))
+                self.text += EXE_RECORD.pack(0,0,0,0,0)
+                return
+        self.text += MIPSProgram.encode(MIPSParser.check_instr(parts,line),self.constants)
+
+    def resolve(self,parts):
+        # replace the label an instruction refers to by its address;
+        # only branches and jumps are expected to refer to text labels
+        kind, addr = self.symbols[parts[-1]]
+        if kind == 'text' and parts[0] not in MIPS_BRANCHES and parts[0] not in ('j','jal'):
+            self.addressed = True
+        parts[-1] = addr
+
+    def program(self,optimize=False):
         # build the program based on the information the parser has
         # gathered; we pretty much leave instructions as they are
         # (performing no processing on them); we do however resolve
         # symbol labels into addresses (i.e. offsets) within the
         # different data sections
 
-        # define a table of symbols that maps to their final address
-        # within the program
-        labels = {}
-
-        # represent the memory segments of the program (data and
-        # stack) using a binary stream; we don't use an actual text
-        # segment since we emulate the machine at a very high level
-        memory = io.BytesIO()
-
-        # create list of tuples of instructions
-        instructions = []
-
-        # write all data entries to the memorystream; add labels to
-        # the 'labels' table; the stack will be allocated at runtime
-        # after the data segment
-        addr = 0
-        for kind, things, label, line in self.data:
-            if label != '':
-                if label in labels:
-                    error_on_line("label '{0}' is already in use".format(label),line)
-                labels[label] = addr
-
-            for thing in things:
-                if kind == 'byte':
-                    bs = struct.pack("<b",thing)
-                elif kind == 'half':
-                    bs = struct.pack("<h",thing)
-                elif kind == 'word':
-                    bs = struct.pack("<i",thing)
-                elif kind == 'ascii':
-                    # this kind has no zero byte terminator
-                    s = MIPSParser.eval_string_literal(thing)
-                    bs = struct.pack("{0}s".format(len(s)),s)
-                elif kind == 'asciiz':
-                    # 'struct.pack' will pad a zero when size exceeds
-                    # length of string
-                    s = MIPSParser.eval_string_literal(thing)
-                    bs = struct.pack("{0}s".format(len(s)+1),s)
-                elif kind == 'space':
-                    # fill in space with zero bytes
-                    bs = struct.pack("{0}b".format(thing),*([0]*thing))
-                addr += memory.write(bs)
+        # resolve labels in any instructions that refer to a label
+        # defined after them; then check to make sure the instruction
+        # is real and having the correct number and type of
+        # arguments; check_instr will perform any other
+        # instruction-specific processing
+        for pc, instrs, line in self.fixups:
+            if instrs[-1] in self.labels:
+                self.resolve(instrs)
+            record = MIPSProgram.encode(MIPSParser.check_instr(instrs,line),self.constants)
+            self.text[pc*EXE_RECORD.size:(pc+1)*EXE_RECORD.size] = record
+        self.fixups = []
+        if optimize and self.optimized is None:
+            self.optimize()
 
         # make sure the data segment size is some multiple of eight
-        memory.write('\x00'*(8 - addr%8))
-        memory.seek(0)
-
-        # go through all instructions and add the appropriate label to
-        # the 'labels' table which should map to the index of the
-        # instruction; if the label already exists then fail
-        offset = 0
-        for _, label, line in self.instr:
-            if label != '':
-                if label in labels:
-                    error_on_line("label '{0}' is already in use".format(label),line)
-                labels[label] = offset
-            offset += 1
-
-        # for each instruction, convert to a tuple and resolve any
-        # labels to a numeric address value; also check to make sure
-        # the instruction is real and having the correct number and
-        # type of arguments; check_instr will perform any other
-        # instruction-specific processing
-        for instrs, _, line in self.instr:
-            # a label can only be used by a select few instructions;
-            # it only appears as the last argument also
-            if instrs[0] in LABEL_INSTRS:
-                if instrs[-1] in labels:
-                    instrs[-1] = labels[instrs[-1]]
-            instructions.append(MIPSParser.check_instr(instrs,line))
-        instructions = tuple(instructions)
-
-        # save tuple of the program information to a pickle file;
-        # place a shebang in the pickle file so we can execute the
-        # program file using the simulator; also mark the file as
-        # executable (this will have no effect on some platforms)
+        self.memory += '\x00'*(8 - len(self.memory)%8)
+
+        instructions = MIPSInstructions(self.text,0,self.count,self.constants)
+        return MIPSProgram(instructions,self.memory,self.symbols,self.lines)
+
+    def optimize(self):
+        # rewrite the instructions with MIPSOptimizer; branch and jump
+        # targets, text labels and source lines follow the instructions
+        # that are kept; an offset of an instruction that is dropped
+        # moves to the next instruction that is kept
+        instr = MIPSInstructions(self.text,0,self.count,self.constants)
+        optimizer = MIPSOptimizer(instr,self.symbols,self.addressed)
+        kept = optimizer.optimize()
+        offsets = [0]*(self.count + 1)
+        i = 0
+        for pc in xrange(self.count + 1):
+            offsets[pc] = i
+            if i < len(kept) and kept[i] == pc:
+                i += 1
+        def offset(pc):
+            if pc < 0:
+                return pc
+            if pc > self.count:
+                return pc - self.count + len(kept)
+            return offsets[pc]
+
+        text = bytearray()
+        constants = []
+        lines = bytearray()
+        for pc in kept:
+            name, a, b, c, imm = optimizer.op(pc)
+            if name in MIPS_BRANCHES or name in ('j','jal'):
+                imm = offset(imm)
+            parts = [name] + [REGISTER_NAMES[x] for x in (a,b,c) if x is not None]
+            if imm is not None:
+                parts.append(imm)
+            text += MIPSProgram.encode(parts,constants)
+            lines += self.lines[pc*EXE_LINE.size:(pc+1)*EXE_LINE.size]
+        for label, (kind, addr) in self.symbols.iteritems():
+            if kind == 'text':
+                self.symbols[label] = (kind,offset(addr))
+                self.labels[label] = offset(addr)
+        self.optimized = (self.count,len(kept))
+        self.text = text
+        self.constants = constants
+        self.lines = lines
+        self.count = len(kept)
+
+    def build_program(self,outfile,optimize=False):
+        # save the program information to a binary executable file
+        # (see MIPSProgram.write); the file starts with a shebang so
+        # we can execute the program file using the simulator; also
+        # mark the file as executable (this will have no effect on
+        # some platforms)
         if isinstance(outfile,str):
             outfile = open(outfile,'wb')
         if isinstance(outfile,file):
             mode = os.stat(outfile.name).st_mode
             os.chmod(outfile.name,mode | 0111)
-        outfile.write(SHEBANG)
-        pickle.dump((instructions,memory.read()),outfile,pickle.HIGHEST_PROTOCOL)
+        self.program(optimize).write(outfile)
 
     @staticmethod
     def check_instr(parts,line):
@@ -1119,7 +2747,7 @@ class MIPSParser:
             error_on_line("'{0}' is not a valid instruction".format(parts[0]),line)
         t = parts[1:]
         iname = parts[0]
-        if not MIPS_INSTRUCTIONS[iname](None,t,line=line):
+        if not MIPS_INSTRUCTIONS[iname](t,line=line):
             error_on_line("'{0}' instruction is not formatted correctly".format(parts[0]),line)
         t.insert(0,iname)
         return t
@@ -1132,46 +2760,699 @@ class MIPSParser:
             literal = re.sub(pat,rep,literal)
         return literal
 
+class MIPSCache:
+    # on-disk cache of assembled programs; entries are executable
+    # files named by a hash of the source they were assembled from
+    # (and the assembler version) and are evicted least recently used
+    # first once the cache grows past its size bound; entries are
+    # written to a temporary file and renamed into place so that
+    # concurrent writers never expose a partial entry
+
+    def __init__(self,directory=None,maxsize=CACHE_SIZE):
+        if directory is None:
+            directory = os.environ.get('PYMIPS_CACHE')
+        if directory is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') \
+                   or os.path.join(os.path.expanduser('~'),'.cache')
+            directory = os.path.join(base,'pymips')
+        self.directory = directory
+        self.maxsize = maxsize
+        self.statsfile = os.path.join(directory,'stats')
+        self.countsfile = os.path.join(directory,'counts')
+
+    @staticmethod
+    def key(source,optimize=False):
+        h = hashlib.sha1("{0}:{1}:{2}:".format(ASSEMBLER_VERSION,EXE_VERSION,int(optimize)))
+        h.update(source)
+        return h.hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.directory,key + CACHE_SUFFIX)
+
+    def get(self,key):
+        # return an open executable file for the entry or None if
+        # there is no such entry; a hit marks the entry as recently
+        # used
+        path = self.path(key)
+        try:
+            f = open(path,'rb')
+            os.utime(path,None)
+        except (IOError,OSError):
+            self.record('m')
+            return None
+        self.record('h')
+        return f
+
+    def put(self,key,content):
+        # add an entry; failing to write to the cache is not an error
+        path = self.path(key)
+        tmp = "{0}.{1}.tmp".format(path,os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp,'wb') as f:
+                f.write(content)
+            try:
+                os.rename(tmp,path)
+            except OSError:
+                # another writer got there first (this only happens on
+                # platforms where rename does not replace files)
+                os.remove(tmp)
+            self.evict()
+        except (IOError,OSError):
+            pass
+
+    def entries(self):
+        # list (mtime,size,path) for each entry
+        result = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(self.directory,name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue # removed concurrently
+                result.append((st.st_mtime,st.st_size,path))
+        return result
+
+    def evict(self):
+        # remove least recently used entries (along with any
+        # translation cached for them) until the cache fits
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.maxsize:
+                break
+            for name in (path,path + TRANSLATION_SUFFIX):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            total -= size
+
+    def record(self,event):
+        # append a hit ('h') or miss ('m') to the statistics log; a
+        # single-byte append is atomic so concurrent runs are safe;
+        # once the log holds CACHE_LOG events they are folded into
+        # the counters so that the log stays small
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd = os.open(self.statsfile,os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                os.write(fd,event)
+                full = os.fstat(fd).st_size >= CACHE_LOG
+            finally:
+                os.close(fd)
+            if full:
+                self.compact()
+        except (IOError,OSError):
+            pass
+
+    def counts(self):
+        # return the (hits,misses) counters
+        try:
+            with open(self.countsfile,'rb') as f:
+                return CACHE_COUNTS.unpack(f.read())
+        except (IOError,struct.error):
+            return 0, 0
+
+    def compact(self):
+        # fold the statistics log into the counters; the log is first
+        # renamed aside so that concurrent runs start a new log (and
+        # only one of them compacts it); the counters are written to
+        # a temporary file and renamed into place like entries are;
+        # runs that compact at the same moment may drop a few events
+        aside = "{0}.{1}.tmp".format(self.statsfile,os.getpid())
+        try:
+            os.rename(self.statsfile,aside)
+        except OSError:
+            return
+        try:
+            with open(aside,'rb') as f:
+                events = f.read()
+        finally:
+            os.remove(aside)
+        hits, misses = self.counts()
+        tmp = "{0}.{1}.tmp".format(self.countsfile,os.getpid())
+        with open(tmp,'wb') as f:
+            f.write(CACHE_COUNTS.pack(hits + events.count('h'),misses + events.count('m')))
+        try:
+            os.rename(tmp,self.countsfile)
+        except OSError:
+            # rename does not replace files on some platforms
+            os.remove(self.countsfile)
+            os.rename(tmp,self.countsfile)
+
+    def report(self,f):
+        try:
+            self.compact()
+        except (IOError,OSError):
+            pass
+        hits, misses = self.counts()
+        try:
+            with open(self.statsfile,'rb') as s:
+                events = s.read()
+        except IOError:
+            events = ""
+        try:
+            entries = self.entries()
+        except OSError:
+            entries = []
+        f.write("pymips: cache directory: {0}\n".format(self.directory))
+        f.write("pymips: cache hits: {0}\n".format(hits + events.count('h')))
+        f.write("pymips: cache misses: {0}\n".format(misses + events.count('m')))
+        f.write("pymips: cache entries: {0}\n".format(len(entries)))
+        f.write("pymips: cache size: {0} bytes\n".format(sum(size for _, size, _ in entries)))
+
+class MIPSSession(asyncore.dispatcher):
+    # a program run by a MIPSHost for one connection: the program reads
+    # the lines sent on the connection and its output (and any error)
+    # is sent back; when the program asks for input that has not
+    # arrived yet its simulator is paused (the input stream raises
+    # MIPSBreak) and the system call is executed again once a line
+    # arrives; the connection is closed once the program has ended and
+    # its output has been sent; the program is simply dropped if the
+    # other end goes away before then; the simulator is set up from
+    # the host's options like 'execmips' sets one up
+
+    def __init__(self,host,sock):
+        asyncore.dispatcher.__init__(self,sock,host.map)
+        options = host.options
+        self.lines = collections.deque() # complete lines of input not read yet
+        self.partial = ""                # input received after the last newline
+        self.eof = False
+        self.waiting = False             # the program is waiting for input
+        self.output = bytearray()        # output not sent yet
+        self.errors = io.BytesIO()
+        self.sim = Simulator(host.program,self,self,self.errors,options.stackSize,options.memorySize)
+        if fusion(options):
+            self.sim.enable_fusion()
+        self.sim.set_limits(options.maxInstructions,options.timeout)
+        host.sessions.append(self)
+
+    # the simulator's input and output streams
+
+    def readline(self):
+        if self.lines:
+            return self.lines.popleft()
+        if self.eof:
+            return ""
+        raise MIPSBreak()
+    def write(self,s):
+        self.output += s
+    def flush(self):
+        pass
+
+    def ready(self):
+        return self.connected and self.sim.status is None and not self.waiting
+
+    def run_slice(self,count):
+        # run the program for at most 'count' instructions
+        try:
+            if self.sim.step(count) is None:
+                return
+        except MIPSBreak:
+            self.waiting = True
+            return
+        self.output += self.errors.getvalue()
+        if not self.output:
+            self.close()
+
+    def readable(self):
+        return not self.eof
+    def handle_read(self):
+        # the socket is read directly (not with 'recv') to tell the end
+        # of the input from a connection that has failed
+        try:
+            data = self.socket.recv(STREAM_CHUNK)
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN,errno.EWOULDBLOCK):
+                self.handle_close()
+            return
+        if not data:
+            self.end_input()
+            return
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        self.lines.extend(l + "\n" for l in lines)
+        self.waiting = self.waiting and not self.lines
+
+    def end_input(self):
+        # the other end is done sending: the program reads the end of
+        # its input; if the program has already ended there is nobody
+        # left to send its output to
+        if self.partial:
+            self.lines.append(self.partial)
+            self.partial = ""
+        self.eof = True
+        self.waiting = False
+        if self.sim.status is not None:
+            self.close()
+
+    def writable(self):
+        return len(self.output) > 0
+    def handle_write(self):
+        del self.output[:self.send(self.output)]
+        if not self.output and self.sim.status is not None:
+            self.close()
+
+    def handle_close(self):
+        # the connection has failed (e.g. the other end has gone away
+        # and its output cannot be sent): the program is stopped and
+        # the host drops the session
+        self.close()
+
+class MIPSHost(asyncore.dispatcher):
+    # runs many programs (sessions) in this process; a session's input
+    # and output are handled as they become possible and runnable
+    # sessions take turns running 'slice' instructions at a time so
+    # that a busy program cannot hold up the others; the host listens
+    # for connections on a local port and starts a session of
+    # 'program' for each one; 'options' are the command-line arguments
+    # (see 'main'): the port, the slice and how each session's
+    # simulator is set up (its stack and memory sizes, fusion and
+    # limits)
+
+    def __init__(self,program,options):
+        self.map = {}
+        self.sessions = []
+        self.program = program
+        self.options = options
+        self.slice = options.slice
+        asyncore.dispatcher.__init__(self,None,self.map)
+        self.create_socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(('127.0.0.1',options.port))
+        self.listen(socket.SOMAXCONN)
+
+    def handle_accept(self):
+        conn = self.accept()
+        if conn is not None:
+            MIPSSession(self,conn[0])
+
+    def run(self):
+        # serve until the host is closed
+        while self.map:
+            self.poll()
+
+    def poll(self,timeout=None):
+        # handle the input and output that is possible and give each
+        # runnable session one slice; the host only waits (at most
+        # 'timeout' seconds) when no session is ready to run; sessions
+        # whose connection has been closed are dropped
+        ready = [session for session in self.sessions if session.ready()]
+        asyncore.loop(0 if ready else timeout,False,self.map,1)
+        for session in ready:
+            if session.connected:
+                session.run_slice(self.slice)
+        self.sessions = [session for session in self.sessions if session.connected]
+
 def execmips(exefile):
     # load the program from the specified 'executable' file and run
     # the simulation
-    sim = MIPSSimulator(exefile)
-    sim.simulation()
+    if args.translate:
+        # run the program through its (cached) translation; the cache
+        # file lives next to the executable if it has one
+        content = exefile.read()
+        path = getattr(exefile,'name',None)
+        if not isinstance(path,str) or path.startswith('<'):
+            path = None
+        else:
+            path += TRANSLATION_SUFFIX
+        sim = MIPSSimulator(io.BytesIO(content),None,args.stackSize,args.memorySize)
+        sim.install_translation(MIPSTranslator.cached(sim.instr,content,path))
+    else:
+        sim = MIPSSimulator(exefile,None,args.stackSize,args.memorySize)
+    if args.tiered:
+        sim.enable_tiering(args.hotThreshold)
+    if args.profile is not None:
+        sim.enable_profiling()
+    if fusion(args):
+        sim.enable_fusion()
+    sim.set_limits(args.maxInstructions,args.timeout)
+    try:
+        sim.simulation()
+    except MIPSError as e:
+        runtime_error(e,e.status)
+    finally:
+        if args.stats:
+            stdout.flush()
+            sim.report_stats(stderr)
+        if args.profile is not None:
+            stdout.flush()
+            profile = sim.profile()
+            sim.report_profile(stderr,profile)
+            with open(args.profile,'w') as f:
+                json.dump(profile,f,indent=2,separators=(",",": "))
+                f.write("\n")
+
+def fusion(args):
+    # fuse instructions unless the options rule it out (see
+    # MIPSSimulator.enable_fusion)
+    return not (args.noFusion or args.translate or args.tiered or args.profile is not None
+                or args.maxInstructions is not None)
+
+def optimized(parser):
+    # report what the optimizer did (see MIPSParser.optimize)
+    if parser.optimized is not None:
+        stderr.write("pymips: optimized {0} instructions to {1}\n".format(*parser.optimized))
 
 def assemblemips(asmfile):
     # assemble the mips instructions from the specified file stream
     # and write them to the specified output file
     global args
     parser = MIPSParser(asmfile)
-    parser.build_program(args.outputFile)
+    parser.build_program(args.outputFile,args.optimize)
+    optimized(parser)
 
 def onestep(asmfile):
     # assemble the mips instructions from the specified file stream
-    # and immediately execute the result
-    parser = MIPSParser(asmfile)
+    # and immediately execute the result; assembled programs are
+    # cached by the content of their source
+    source = asmfile.read()
+    cache = key = None
+    if not args.noCache:
+        cache = MIPSCache(args.cacheDir,args.cacheSize << 20)
+        key = cache.key(source,args.optimize)
+        exefile = cache.get(key)
+        if exefile is not None:
+            with exefile:
+                execmips(exefile)
+            return
+    parser = MIPSParser(io.BytesIO(source))
     with io.BytesIO() as exefile: # write program to in-memory file
-        parser.build_program(exefile)
+        parser.build_program(exefile,args.optimize)
+        if args.stats:
+            optimized(parser)
+        if cache is not None:
+            cache.put(key,exefile.getvalue())
         exefile.seek(0)
         execmips(exefile)
 
-# create a MIPSSystem object to handle system interactions
-system = MIPSSystem()
-
-# create argument parser for simulator and parse command-line
-# arguments
-argp = argparse.ArgumentParser(description="A simple MIPS simulator")
-argp.add_argument('filename',default=None,nargs='?',metavar='file',
-                  help="input file for process (defaults to stdin if omitted)")
-argp.add_argument('-a','--assemble',dest='action',action="store_const",default=execmips,
-                  const=assemblemips,help="assemble the specified assembly code")
-argp.add_argument('--one-step',dest='action',action='store_const',const=onestep,
-                  help="assemble and execute in one step")
-argp.add_argument('-o','--output-file',dest='outputFile',default='a.mips',nargs='?',
-                  help="output file to write assembled program")
-args = argp.parse_args()
-
-if args.filename is None and args.action == execmips:
-    runtime_error("no input program file")
-
-with stdin if args.filename is None else open(args.filename,'rb') as f:
-    args.action(f)
+def batchsim(prog,code,system):
+    # create a simulator for a program run by a batch worker
+    sim = MIPSSimulator(prog,system,args.stackSize,args.memorySize)
+    if code is not None:
+        sim.install_translation(code)
+    if args.tiered:
+        sim.enable_tiering(args.hotThreshold)
+    if fusion(args):
+        sim.enable_fusion()
+    sim.set_limits(args.maxInstructions,args.timeout)
+    return sim
+
+def batchload(program):
+    # load a program for 'runcase'; the program is run up to the point
+    # where it first asks for input and the state of the simulator at
+    # that point is kept along with the output written so far so that
+    # each case only has to run the part of the program that depends
+    # on its input; a program that exits (or fails) before reading
+    # any input is simply run from the start for every case
+    with open(program,'rb') as f:
+        content = f.read()
+    prog = MIPSProgram.load(io.BytesIO(content))
+    code = None
+    if args.translate:
+        code = MIPSTranslator.cached(prog.instr,content,program + TRANSLATION_SUFFIX)
+    state = output = None
+    if not args.noSnapshot:
+        out = io.BytesIO()
+        try:
+            sim = batchsim(prog,code,MIPSSystem(None,out,io.BytesIO()))
+            sim.run_until()
+            if not sim.system.fdtable:
+                # files the program has opened cannot be shared by cases
+                state = sim.snapshot()
+                output = out.getvalue()
+        except (SystemExit,MIPSError):
+            pass
+    batchPrograms[program] = (prog,code,state,output)
+
+def runcase(case):
+    # run one case of a batch (see 'batch') in this process; each
+    # program is loaded (and translated) once per process; the exit
+    # status and output of the program are captured along with any
+    # error messages
+    program, infile, expected, status = case
+    result = collections.OrderedDict([('program',program),('input',infile),('expected',expected)])
+    start = time.time()
+    out = io.BytesIO()
+    err = io.BytesIO()
+    try:
+        if program not in batchPrograms:
+            batchload(program)
+        prog, code, state, output = batchPrograms[program]
+        with io.BytesIO() if infile is None else open(infile,'rb') as f:
+            sim = batchsim(prog,code,MIPSSystem(f,out,err))
+            if state is not None:
+                # resume from where the program first asked for input;
+                # the instructions that led there count towards the
+                # instruction limit
+                out.write(output)
+                sim.restore(state)
+            sim.simulation()
+        result['status'] = 0
+    except SystemExit as e:
+        result['status'] = exit_status(e,err)
+    except MIPSError as e:
+        err.write("pymips: error: {0}\n".format(e))
+        result['status'] = e.status
+    except Exception as e:
+        err.write("pymips: error: {0}\n".format(e))
+        result['status'] = 1
+    result['time'] = time.time() - start
+    result['stdout'] = out.getvalue().decode('utf-8','replace')
+    result['stderr'] = err.getvalue().decode('utf-8','replace')
+    result['passed'] = None
+    if expected is not None:
+        with open(expected,'rb') as f:
+            result['passed'] = out.getvalue() == f.read() \
+                               and (status is None or status == result['status'])
+    return result
+
+def batch(f):
+    # run the cases listed in a manifest file across a pool of worker
+    # processes and write a summary of the results in JSON; the
+    # manifest is a JSON list of objects with a 'program' executable
+    # and optionally an 'input' file, an 'expected' output file and
+    # an expected exit 'status'; paths are relative to the manifest
+    base = os.path.dirname(os.path.abspath(f.name)) if f is not stdin else os.getcwd()
+    def path(p):
+        return None if p is None else os.path.join(base,p)
+    cases = [(path(entry['program']),path(entry.get('input')),path(entry.get('expected')),
+              entry.get('status')) for entry in json.load(f)]
+
+    # hand out cases in chunks so that consecutive runs of the same
+    # program tend to reuse a worker's loaded copy of it
+    start = time.time()
+    jobs = args.jobs or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = list(pool.imap(runcase,cases,max(1,len(cases) // (jobs*8))))
+    finally:
+        pool.close()
+        pool.join()
+    passed = sum(1 for r in results if r['passed'])
+    failed = sum(1 for r in results if r['passed'] is False)
+    summary = collections.OrderedDict([('total',len(results)),('passed',passed),('failed',failed),
+                                       ('jobs',jobs),('time',time.time() - start),('cases',results)])
+    json.dump(summary,stdout,indent=2,separators=(",",": "))
+    stdout.write("\n")
+    if failed > 0:
+        exit(1)
+
+def serve(f):
+    # run a session of the program for each connection to a local port
+    # (see MIPSHost); every session's memory is set up the same way
+    # so it is checked once here
+    program = MIPSProgram.load(f)
+    MIPSMemory(program.data,args.stackSize,args.memorySize)
+    host = MIPSHost(program,args)
+    stderr.write("pymips: serving on {0}:{1}\n".format(*host.getsockname()))
+    stderr.flush()
+    try:
+        host.run()
+    except KeyboardInterrupt:
+        pass
+
+def cachestats(f):
+    # report statistics for the assembled program cache
+    MIPSCache(args.cacheDir).report(stdout)
+
+def exit_status(e,err):
+    # return the status a process would exit with for SystemExit 'e';
+    # a message passed to 'exit' is written to 'err'
+    if e.code is None:
+        return 0
+    if isinstance(e.code,(int,long)):
+        return e.code & 0xff
+    err.write("{0}\n".format(e.code))
+    return 1
+
+# programs loaded by a batch worker process (see 'runcase')
+batchPrograms = {}
+
+# command-line arguments (see 'main'); the actions above read them and
+# batch worker processes inherit them
+args = None
+
+# library interface: other Python programs can import this module and
+# assemble and run programs in their own process, e.g.
+#
+#  import io, pymips
+#  program = pymips.assemble(open('fib.s').read())  # may raise pymips.MIPSError
+#  out = io.BytesIO()
+#  sim = pymips.Simulator(program,stdin=io.BytesIO("10\n"),stdout=out)
+#  status = sim.run()
+#  sim.reset(stdin=io.BytesIO("20\n"))
+#  status = sim.run()
+
+Program = MIPSProgram
+
+def assemble(source,optimize=False):
+    # assemble MIPS source code (a string or a file) into a program;
+    # see MIPSOptimizer for 'optimize'; errors in the source raise
+    # MIPSError
+    if isinstance(source,basestring):
+        source = io.BytesIO(source)
+    return MIPSParser(source).program(optimize)
+
+class Simulator(MIPSSimulator):
+    # a simulator that reports the end of the program (because it
+    # exited or failed) as the exit status the process would have had
+    # instead of ending this process; error messages (and what the
+    # program writes to descriptor 2) are written to 'stderr'; a
+    # program that cannot be loaded or does not fit in memory raises
+    # MIPSError; 'program' is a Program (see 'assemble') or an
+    # executable file
+
+    def __init__(self,program,stdin=stdin,stdout=stdout,stderr=stderr,stackSize=STACK_SPACE,
+                 memorySize=MEMORY_SIZE):
+        MIPSSimulator.__init__(self,program,MIPSSystem(stdin,stdout,stderr),stackSize,memorySize)
+        self.stderr = stderr
+        self.status = None # exit status once the program has ended
+
+    def call(self,method,*params):
+        # call a method of MIPSSimulator and catch the end of the program
+        try:
+            method(self,*params)
+        except SystemExit as e:
+            self.status = exit_status(e,self.stderr)
+        except MIPSError as e:
+            self.stderr.write("pymips: error: {0}\n".format(e))
+            self.status = e.status
+        return self.status
+
+    def run(self):
+        # run the program until it ends; return its exit status
+        if self.status is None:
+            self.call(MIPSSimulator.simulation)
+        return self.status
+
+    def step(self,count=1):
+        # execute the next 'count' instructions; return the exit status
+        # if the program has ended or None if it can keep running
+        if self.status is None:
+            self.call(MIPSSimulator.step,count)
+        return self.status
+
+    def reset(self,stdin=None,stdout=None):
+        # start the program over, optionally with new input and output
+        # streams; the simulator's memory and decoded program are reused
+        system = self.system
+        system.flush()
+        for f in system.fdtable.values():
+            f.close()
+        MIPSSimulator.reset(self,MIPSSystem(system.infile if stdin is None else stdin,
+                                            system.outfile if stdout is None else stdout,
+                                            system.errfile))
+        self.status = None
+
+def main(argv=None):
+    # create argument parser for simulator and parse command-line
+    # arguments; then run the action they select
+    global args
+    argp = argparse.ArgumentParser(description="A simple MIPS simulator")
+    argp.add_argument('filename',default=None,nargs='?',metavar='file',
+                      help="input file for process (defaults to stdin if omitted)")
+    argp.add_argument('-a','--assemble',dest='action',action="store_const",default=execmips,
+                      const=assemblemips,help="assemble the specified assembly code")
+    argp.add_argument('--one-step',dest='action',action='store_const',const=onestep,
+                      help="assemble and execute in one step")
+    argp.add_argument('-O','--optimize',dest='optimize',action='store_true',
+                      help="simplify the program's instructions when assembling it (folds constants, "
+                      "propagates copies, threads jumps and drops instructions that have no effect)")
+    argp.add_argument('--no-cache',dest='noCache',action='store_true',
+                      help="do not cache assembled programs when using --one-step")
+    argp.add_argument('--cache-dir',dest='cacheDir',default=None,metavar='DIR',
+                      help="directory for cached assembled programs (defaults to $PYMIPS_CACHE "
+                      "or a 'pymips' directory in the user's cache directory)")
+    argp.add_argument('--cache-size',dest='cacheSize',type=int,default=CACHE_SIZE >> 20,metavar='MB',
+                      help="size bound of the assembled program cache (default: %(default)s)")
+    argp.add_argument('--cache-stats',dest='action',action='store_const',const=cachestats,
+                      help="report assembled program cache statistics")
+    argp.add_argument('--batch',dest='action',action='store_const',const=batch,
+                      help="run the programs and inputs listed in a JSON manifest file across a "
+                      "pool of processes and write a JSON summary")
+    argp.add_argument('--no-snapshot',dest='noSnapshot',action='store_true',
+                      help="run each --batch case from the start instead of resuming a snapshot taken "
+                      "where the program first asks for input")
+    argp.add_argument('-j','--jobs',dest='jobs',type=int,default=None,metavar='N',
+                      help="number of worker processes for --batch (defaults to the number of CPUs)")
+    argp.add_argument('--serve',dest='action',action='store_const',const=serve,
+                      help="run a session of the program for every connection to a local port; "
+                      "each session reads the lines sent to it and sends back its output")
+    argp.add_argument('--port',dest='port',type=int,default=SERVE_PORT,metavar='PORT',
+                      help="port to serve on with --serve (default: %(default)s)")
+    argp.add_argument('--slice',dest='slice',type=int,default=SLICE_STEPS,metavar='N',
+                      help="number of instructions a session runs before the next session gets "
+                      "a turn with --serve (default: %(default)s)")
+    argp.add_argument('-t','--translate',dest='translate',action='store_true',
+                      help="translate the program to Python before executing it (the translation "
+                      "is cached next to the program file)")
+    argp.add_argument('--tiered',dest='tiered',action='store_true',
+                      help="compile loops to Python once they become hot")
+    argp.add_argument('--hot-threshold',dest='hotThreshold',type=int,default=HOT_THRESHOLD,metavar='N',
+                      help="number of iterations after which a loop is hot (default: %(default)s)")
+    argp.add_argument('--no-fusion',dest='noFusion',action='store_true',
+                      help="run every instruction on its own instead of running common groups of "
+                      "instructions as one operation")
+    argp.add_argument('--profile',dest='profile',default=None,metavar='FILE',
+                      help="count the instructions executed per opcode and per source line and time "
+                      "each system call; a report is written on stderr and the full profile is "
+                      "written to FILE in JSON (cannot be combined with -t or --tiered)")
+    argp.add_argument('--max-instructions',dest='maxInstructions',type=int,default=None,metavar='N',
+                      help="stop the program with exit status {0} once it has executed N "
+                      "instructions".format(LIMIT_STATUS))
+    argp.add_argument('--timeout',dest='timeout',type=float,default=None,metavar='SECONDS',
+                      help="stop the program with exit status {0} once it has run for SECONDS "
+                      "seconds".format(LIMIT_STATUS))
+    argp.add_argument('--stack-size',dest='stackSize',type=int,default=STACK_SPACE,metavar='BYTES',
+                      help="size of the program's stack (default: %(default)s)")
+    argp.add_argument('--memory-size',dest='memorySize',type=int,default=MEMORY_SIZE,metavar='BYTES',
+                      help="size of the program's address space; the stack starts at the top "
+                      "(default: %(default)s)")
+    argp.add_argument('--stats',dest='stats',action='store_true',
+                      help="report execution statistics on stderr when the program ends")
+    argp.add_argument('-o','--output-file',dest='outputFile',default='a.mips',nargs='?',
+                      help="output file to write assembled program")
+    args = argp.parse_args(argv)
+
+    if args.filename is None and args.action == execmips:
+        runtime_error("no input program file")
+    if args.profile is not None and (args.translate or args.tiered):
+        runtime_error("--profile cannot be combined with -t or --tiered")
+    if (args.maxInstructions is not None or args.timeout is not None) and (args.translate or args.tiered):
+        runtime_error("--max-instructions and --timeout cannot be combined with -t or --tiered")
+    if args.action == serve and (args.translate or args.tiered or args.profile is not None):
+        runtime_error("--serve cannot be combined with -t, --tiered or --profile")
+
+    try:
+        with stdin if args.filename is None else open(args.filename,'rb') as f:
+            args.action(f)
+    except MIPSError as e:
+        runtime_error(e,e.status)
+
+if __name__ == '__main__':
+    main()
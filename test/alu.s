@@ -0,0 +1,309 @@
+        ## edge cases of the instructions the ALU kernel runs (see
+        ## MIPS_SEMANTICS): every pair of boundary values goes through
+        ## each register form and every value through each immediate
+        ## and shift form; each line of output is one operand or pair;
+        ## test/alu.out holds the expected output
+        .data
+vals:   .word   0, 1, -1, -2147483648, 2147483647, 65535, -32768, 12345
+shifts: .word   0, 1, 31, 32, 33
+newl:   .asciiz "\n"
+
+        .text
+main:
+        ## every pair of values
+        la      $s0, vals
+        li      $s2, 8
+outer:
+        la      $s1, vals
+        li      $s3, 8
+inner:
+        lw      $t0, ($s0)
+        lw      $t1, ($s1)
+
+        ## add/sub/mul wrap around
+        add     $a0, $t0, $t1
+        jal     show
+        addu    $a0, $t0, $t1
+        jal     show
+        sub     $a0, $t0, $t1
+        jal     show
+        subu    $a0, $t0, $t1
+        jal     show
+        mul     $a0, $t0, $t1
+        jal     show
+        mulu    $a0, $t0, $t1
+        jal     show
+
+        ## 64-bit products in hi/lo
+        mult    $t0, $t1
+        mfhi    $a0
+        jal     show
+        mflo    $a0
+        jal     show
+        multu   $t0, $t1
+        mfhi    $a0
+        jal     show
+        mflo    $a0
+        jal     show
+
+        ## quotients and remainders (not by zero)
+        beq     $t1, $zero, nodiv
+        div     $t0, $t1
+        mflo    $a0
+        jal     show
+        mfhi    $a0
+        jal     show
+        divu    $t0, $t1
+        mflo    $a0
+        jal     show
+        mfhi    $a0
+        jal     show
+        rem     $a0, $t0, $t1
+        jal     show
+nodiv:
+
+        ## logic
+        and     $a0, $t0, $t1
+        jal     show
+        or      $a0, $t0, $t1
+        jal     show
+        xor     $a0, $t0, $t1
+        jal     show
+        nor     $a0, $t0, $t1
+        jal     show
+
+        ## signed and unsigned compares
+        slt     $a0, $t0, $t1
+        jal     show
+        sltu    $a0, $t0, $t1
+        jal     show
+        li      $a0, 1
+        beq     $t0, $t1, taken1
+        li      $a0, 0
+taken1:
+        jal     show
+        li      $a0, 1
+        bne     $t0, $t1, taken2
+        li      $a0, 0
+taken2:
+        jal     show
+        li      $a0, 1
+        blt     $t0, $t1, taken3
+        li      $a0, 0
+taken3:
+        jal     show
+        li      $a0, 1
+        bgt     $t0, $t1, taken4
+        li      $a0, 0
+taken4:
+        jal     show
+
+        ## moves
+        mthi    $t0
+        mtlo    $t1
+        mfhi    $a0
+        jal     show
+        mflo    $a0
+        jal     show
+        nop
+        move    $a0, $t1
+        jal     show
+
+        jal     line
+        addi    $s1, $s1, 4
+        addi    $s3, $s3, -1
+        bne     $s3, $zero, inner
+        addi    $s0, $s0, 4
+        addi    $s2, $s2, -1
+        bne     $s2, $zero, outer
+
+        ## every value
+        la      $s0, vals
+        li      $s2, 8
+single:
+        lw      $t0, ($s0)
+
+        ## immediates
+        addi    $a0, $t0, 1
+        jal     show
+        addiu   $a0, $t0, 1
+        jal     show
+        addi    $a0, $t0, -1
+        jal     show
+        addiu   $a0, $t0, -1
+        jal     show
+        addi    $a0, $t0, 32767
+        jal     show
+        addiu   $a0, $t0, 32767
+        jal     show
+        addi    $a0, $t0, -32768
+        jal     show
+        addiu   $a0, $t0, -32768
+        jal     show
+        andi    $a0, $t0, 0
+        jal     show
+        ori     $a0, $t0, 0
+        jal     show
+        xori    $a0, $t0, 0
+        jal     show
+        andi    $a0, $t0, 1
+        jal     show
+        ori     $a0, $t0, 1
+        jal     show
+        xori    $a0, $t0, 1
+        jal     show
+        andi    $a0, $t0, 65535
+        jal     show
+        ori     $a0, $t0, 65535
+        jal     show
+        xori    $a0, $t0, 65535
+        jal     show
+        andi    $a0, $t0, -1
+        jal     show
+        ori     $a0, $t0, -1
+        jal     show
+        xori    $a0, $t0, -1
+        jal     show
+        slti    $a0, $t0, 0
+        jal     show
+        sltiu   $a0, $t0, 0
+        jal     show
+        slti    $a0, $t0, 1
+        jal     show
+        sltiu   $a0, $t0, 1
+        jal     show
+        slti    $a0, $t0, -1
+        jal     show
+        sltiu   $a0, $t0, -1
+        jal     show
+        slti    $a0, $t0, 32767
+        jal     show
+        sltiu   $a0, $t0, 32767
+        jal     show
+        slti    $a0, $t0, -32768
+        jal     show
+        sltiu   $a0, $t0, -32768
+        jal     show
+        rem     $a0, $t0, 7
+        jal     show
+        rem     $a0, $t0, -7
+        jal     show
+        rem     $a0, $t0, 1
+        jal     show
+        move    $a0, $t0
+        lhi     $a0, 0
+        jal     show
+        move    $a0, $t0
+        llo     $a0, 0
+        jal     show
+        move    $a0, $t0
+        lhi     $a0, 1
+        jal     show
+        move    $a0, $t0
+        llo     $a0, 1
+        jal     show
+        move    $a0, $t0
+        lhi     $a0, 65535
+        jal     show
+        move    $a0, $t0
+        llo     $a0, 65535
+        jal     show
+
+        ## shifts by a constant (including sra and srl of negative values)
+        sll     $a0, $t0, 0
+        jal     show
+        sra     $a0, $t0, 0
+        jal     show
+        srl     $a0, $t0, 0
+        jal     show
+        sll     $a0, $t0, 1
+        jal     show
+        sra     $a0, $t0, 1
+        jal     show
+        srl     $a0, $t0, 1
+        jal     show
+        sll     $a0, $t0, 31
+        jal     show
+        sra     $a0, $t0, 31
+        jal     show
+        srl     $a0, $t0, 31
+        jal     show
+        sll     $a0, $t0, 32
+        jal     show
+        sra     $a0, $t0, 32
+        jal     show
+        srl     $a0, $t0, 32
+        jal     show
+        sll     $a0, $t0, 33
+        jal     show
+        sra     $a0, $t0, 33
+        jal     show
+        srl     $a0, $t0, 33
+        jal     show
+
+        ## shifts by a register
+        la      $s1, shifts
+        li      $s3, 5
+shift:
+        lw      $t1, ($s1)
+        sllv    $a0, $t0, $t1
+        jal     show
+        srav    $a0, $t0, $t1
+        jal     show
+        srlv    $a0, $t0, $t1
+        jal     show
+        addi    $s1, $s1, 4
+        addi    $s3, $s3, -1
+        bne     $s3, $zero, shift
+
+        ## compares with zero
+        li      $a0, 1
+        bgez    $t0, taken5
+        li      $a0, 0
+taken5:
+        jal     show
+        li      $a0, 1
+        bgtz    $t0, taken6
+        li      $a0, 0
+taken6:
+        jal     show
+        li      $a0, 1
+        blez    $t0, taken7
+        li      $a0, 0
+taken7:
+        jal     show
+
+        jal     line
+        addi    $s0, $s0, 4
+        addi    $s2, $s2, -1
+        bne     $s2, $zero, single
+
+        ## immediates that do not fit in a word
+        li      $a0, 4294967295
+        jal     show
+        li      $a0, -2147483649
+        jal     show
+        li      $t0, 4294967296
+        addi    $a0, $t0, 4294967297
+        jal     show
+        sll     $a0, $t0, 4
+        jal     show
+        jal     line
+
+        li      $a0, 0
+        li      $v0, 10
+        syscall
+
+show:                           # print $a0 followed by a space
+        li      $v0, 1
+        syscall
+        li      $v0, 11
+        li      $a0, 32
+        syscall
+        jr      $ra
+
+line:                           # end a line of output
+        li      $v0, 4
+        la      $a0, newl
+        syscall
+        jr      $ra
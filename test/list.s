@@ -0,0 +1,46 @@
+    # copy a title line from the input to the output with the file
+    # system calls, then read integers until 0 into a linked list
+    # allocated with sbrk and print them back in reverse order, one
+    # per line
+    .data
+title:
+    .space 64
+    .text
+main:
+    li $a0, 0               # read(0, title, 64)
+    la $a1, title
+    li $a2, 64
+    li $v0, 14
+    syscall
+    move $a2, $v0           # write(1, title, what was read)
+    li $a0, 1
+    la $a1, title
+    li $v0, 15
+    syscall
+    move $s0, $zero         # head of the list
+read:
+    li $v0, 5
+    syscall
+    beq $v0, $zero, print
+    move $s1, $v0
+    li $a0, 8               # node: value, next
+    li $v0, 9
+    syscall
+    sw $s1, 0($v0)
+    sw $s0, 4($v0)
+    move $s0, $v0
+    j read
+print:
+    beq $s0, $zero, done
+    lw $a0, 0($s0)
+    li $v0, 1
+    syscall
+    li $a0, 10
+    li $v0, 11
+    syscall
+    lw $s0, 4($s0)
+    j print
+done:
+    li $a0, 0
+    li $v0, 10
+    syscall
@@ -0,0 +1,611 @@
+#!/usr/bin/env python
+
+# test_pymips.py
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import ctypes
+import shutil
+import socket
+import argparse
+import subprocess
+import itertools
+import tempfile
+import unittest
+
+# run from anywhere: python test/test_pymips.py
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(TEST_DIR,'..'))
+import pymips
+
+INT_MIN = -0x80000000
+INT_MAX = 0x7fffffff
+BOUNDARY = (0,1,-1,INT_MIN,INT_MAX,2,-2,0x7fff,-0x8000,0xffff,0x10000,12345,-7)
+SHIFTS = (0,1,31,32,33,63)
+LARGE = (0xffffffff,0x100000005,INT_MIN - 1,-0x100000000) # immediates that do not fit in a word
+
+def s32(x):
+    return ctypes.c_int32(x).value
+def u32(x):
+    return ctypes.c_uint32(x).value
+def sra(t,u):
+    return u32((t >> u) & ~((-1 if t & 0x80000000 else 0) >> u))
+
+# the results of the instructions as the original implementation
+# computed them (with ctypes, before the ALU kernel); each function
+# takes the values of the operands and returns what is written to the
+# destination register (which wraps it to a signed word), or a pair of
+# (hi,lo) for the instructions that write those
+REFERENCE = {'add':lambda t,u: s32(t + u),'addu':lambda t,u: u32(t + u),
+             'addi':lambda t,u: s32(t + u),'addiu':lambda t,u: u32(t + u),
+             'and':lambda t,u: t & u,'andi':lambda t,u: u32(t & u),
+             'div':lambda t,u: (s32(t % u),s32(t // u)),'divu':lambda t,u: (u32(t % u),u32(t // u)),
+             'mul':lambda t,u: s32(t * u),'mulu':lambda t,u: u32(t * u),
+             'mult':lambda t,u: (s32(t * u >> 32),s32(t * u)),
+             'multu':lambda t,u: (u32(t * u >> 32),u32(t * u)),
+             'nor':lambda t,u: u32(~(t | u)),'or':lambda t,u: u32(t | u),'ori':lambda t,u: u32(t | u),
+             'rem':lambda t,u: u32(t % u),
+             'sll':lambda t,u: u32(t << u),'sllv':lambda t,u: u32(t << u),
+             'sra':sra,'srav':sra,'srl':lambda t,u: u32(t >> u),'srlv':lambda t,u: u32(t >> u),
+             'sub':lambda t,u: s32(t - u),'subu':lambda t,u: u32(t - u),
+             'xor':lambda t,u: u32(t ^ u),'xori':lambda t,u: u32(t ^ u32(u)),
+             'slt':lambda t,u: int(s32(t) < s32(u)),'sltu':lambda t,u: int(u32(t) < u32(u)),
+             'slti':lambda t,u: int(s32(t) < s32(u)),'sltiu':lambda t,u: int(u32(t) < u32(u)),
+             'lhi':lambda t,u: (t & 0xffff) | (u << 16),'llo':lambda t,u: (t & 0xffff0000) | (u << 16),
+             'la':lambda t,u: u,'li':lambda t,u: u,
+             'move':lambda t,u: u,'mfhi':lambda t,u: u,'mflo':lambda t,u: u,
+             'mthi':lambda t,u: t,'mtlo':lambda t,u: t,'nop':None,
+             'beq':lambda t,u: s32(t) == s32(u),'bne':lambda t,u: s32(t) != s32(u),
+             'blt':lambda t,u: s32(t) < s32(u),'bgt':lambda t,u: s32(t) > s32(u),
+             'bgez':lambda t,u: s32(t) >= 0,'bgtz':lambda t,u: s32(t) > 0,'blez':lambda t,u: s32(t) <= 0}
+# loads and stores are decoded by hand and only share their templates
+# with the translator
+MEMORY = ('lb','lbu','lh','lhu','lw','sb','sh','sw')
+
+class AssembleTest(unittest.TestCase):
+    def test_error(self):
+        # a source error is raised to the caller instead of ending the
+        # process
+        with self.assertRaises(pymips.MIPSError) as cm:
+            pymips.assemble("bogus")
+        self.assertEqual(cm.exception.line,1)
+        self.assertEqual(cm.exception.msg,"cannot understand 'bogus'")
+
+    def test_error_line(self):
+        with self.assertRaises(pymips.MIPSError) as cm:
+            pymips.assemble(".text\nli $t0, 1\nadd $t0, $t1\n")
+        self.assertEqual(cm.exception.line,3)
+
+    def test_run(self):
+        program = pymips.assemble(".text\nli $a0, 42\nli $v0, 1\nsyscall\nli $a0, 3\nli $v0, 10\nsyscall\n")
+        out = io.BytesIO()
+        sim = pymips.Simulator(program,stdin=io.BytesIO(),stdout=out)
+        self.assertEqual(sim.run(),3)
+        self.assertEqual(out.getvalue(),"42")
+
+class StreamTest(unittest.TestCase):
+    # a source larger than STREAM_CHUNK is assembled a chunk at a time;
+    # labels may be used before the chunk that defines them
+    COUNT = 20000
+
+    def source(self):
+        lines = [".text","li $t0, 0","j start","back:"]
+        lines += ["addi $t0, $t0, 1 # count"] * self.COUNT
+        lines += ["move $a0, $t0","li $v0, 1","syscall","li $a0, 0","li $v0, 10","syscall",
+                  "start:","j back"]
+        return "\n".join(lines) + "\n"
+
+    def test_tokens(self):
+        source = self.source()
+        self.assertGreater(len(source),2 * pymips.STREAM_CHUNK)
+        self.assertEqual(list(pymips.MIPSParser.tokens(io.BytesIO(source))),
+                         list(pymips.MIPSParser.tokenize(source)))
+
+    def test_run(self):
+        out = io.BytesIO()
+        sim = pymips.Simulator(pymips.assemble(self.source()),stdin=io.BytesIO(),stdout=out)
+        self.assertEqual(sim.run(),0)
+        self.assertEqual(out.getvalue(),str(self.COUNT))
+
+    def test_error_line(self):
+        with self.assertRaises(pymips.MIPSError) as cm:
+            pymips.assemble(self.source().replace("li $v0, 1","bogus"))
+        self.assertEqual(cm.exception.line,4 + self.COUNT + 2)
+
+class SimulatorTest(unittest.TestCase):
+    # the simulator reports errors to its own streams and never ends
+    # this process
+
+    def test_memory(self):
+        with self.assertRaises(pymips.MIPSError):
+            pymips.Simulator(pymips.assemble(".text\nnop\n"),memorySize=4096)
+
+    def test_error(self):
+        out, err = io.BytesIO(), io.BytesIO()
+        sim = pymips.Simulator(pymips.assemble(".text\nli $a0, 5\nli $v0, 1\nsyscall\nli $v0, 99\nsyscall\n"),
+                               stdin=io.BytesIO(),stdout=out,stderr=err)
+        self.assertEqual(sim.run(),1)
+        self.assertEqual(out.getvalue(),"5")
+        self.assertEqual(err.getvalue(),"pymips: error: could not execute system call 99: no such service\n")
+
+    def test_stderr(self):
+        # descriptor 2 is the simulator's error stream
+        out, err = io.BytesIO(), io.BytesIO()
+        source = (".data\nmsg: .asciiz \"oops\"\n.text\nli $a0, 2\nla $a1, msg\nli $a2, 4\nli $v0, 15\n"
+                  "syscall\nli $a0, 0\nli $v0, 10\nsyscall\n")
+        sim = pymips.Simulator(pymips.assemble(source),stdin=io.BytesIO(),stdout=out,stderr=err)
+        self.assertEqual(sim.run(),0)
+        self.assertEqual((out.getvalue(),err.getvalue()),("","oops"))
+
+    def test_read_string(self):
+        # reads up to a newline, the amount asked for or the end of the
+        # input, whichever comes first
+        source = (".data\nbuf: .space 32\n.text\nla $a0, buf\nli $a1, {0}\nli $v0, 8\nsyscall\n"
+                  "li $v0, 4\nsyscall\nli $a0, 0\nli $v0, 10\nsyscall\n")
+        for amount, data, expected in ((15,"abcdefghij","abcdefghij"),(4,"abcdefghij","abcd"),
+                                       (15,"abc\ndef\n","abc\n")):
+            out = io.BytesIO()
+            sim = pymips.Simulator(pymips.assemble(source.format(amount)),stdin=io.BytesIO(data),stdout=out)
+            self.assertEqual(sim.run(),0)
+            self.assertEqual(out.getvalue(),expected)
+
+    def test_pages(self):
+        # memory is only allocated for the pages that are written to;
+        # anything outside of the data segment, heap and stack faults
+        out, err = io.BytesIO(), io.BytesIO()
+        source = ".text\naddi $sp, $sp, -4\nsw $sp, 0($sp)\nli $t0, 1048576\nlw $a0, 0($t0)\n"
+        sim = pymips.Simulator(pymips.assemble(source),stdin=io.BytesIO(),stdout=out,stderr=err,
+                               memorySize=1 << 30)
+        self.assertEqual(sim.run(),1)
+        self.assertIn("segmentation fault",err.getvalue())
+        self.assertIn("on line 5",err.getvalue())
+        self.assertEqual([n for n, page in sim.memory.pages.items() if page is not pymips.ZERO_PAGE],
+                         [((1 << 30) - 4) >> pymips.PAGE_SHIFT])
+
+    def test_files(self):
+        # write a file, then read it back and print it
+        directory = tempfile.mkdtemp()
+        try:
+            name = os.path.join(directory,'data')
+            source = (".data\nname: .asciiz \"{0}\"\ntext: .asciiz \"hello\"\nbuf: .space 16\n.text\n"
+                      "la $a0, name\nli $a1, 1\nli $a2, 0\nli $v0, 13\nsyscall\nmove $s0, $v0\n"
+                      "move $a0, $s0\nla $a1, text\nli $a2, 5\nli $v0, 15\nsyscall\n"
+                      "move $a0, $s0\nli $v0, 16\nsyscall\n"
+                      "la $a0, name\nli $a1, 0\nli $a2, 0\nli $v0, 13\nsyscall\nmove $s0, $v0\n"
+                      "move $a0, $s0\nla $a1, buf\nli $a2, 16\nli $v0, 14\nsyscall\nmove $s1, $v0\n"
+                      "move $a0, $s0\nli $v0, 16\nsyscall\n"
+                      "li $a0, 1\nla $a1, buf\nmove $a2, $s1\nli $v0, 15\nsyscall\n"
+                      "li $a0, 99\nli $v0, 16\nsyscall\nmove $a0, $v0\nli $v0, 1\nsyscall\n"
+                      "li $a0, 0\nli $v0, 10\nsyscall\n").format(name)
+            out = io.BytesIO()
+            sim = pymips.Simulator(pymips.assemble(source),stdin=io.BytesIO(),stdout=out)
+            self.assertEqual(sim.run(),0)
+            self.assertEqual(out.getvalue(),"hello-1")
+            with open(name,'rb') as f:
+                self.assertEqual(f.read(),"hello")
+        finally:
+            shutil.rmtree(directory)
+
+class LoadTest(unittest.TestCase):
+    SOURCE = ".text\nli $a0, 42\nli $v0, 1\nsyscall\nli $a0, 3\nli $v0, 10\nsyscall\n"
+
+    def run_file(self,f):
+        out = io.BytesIO()
+        sim = pymips.Simulator(f,stdin=io.BytesIO(),stdout=out)
+        return sim.run(), out.getvalue()
+
+    def test_stream(self):
+        # an executable that cannot be mapped is read instead
+        f = io.BytesIO()
+        pymips.assemble(self.SOURCE).write(f)
+        f.seek(0)
+        self.assertEqual(self.run_file(f),(3,"42"))
+
+    def test_pipe(self):
+        # a pipe cannot be mapped or seek
+        f = io.BytesIO()
+        pymips.assemble(self.SOURCE).write(f)
+        r, w = os.pipe()
+        os.write(w,f.getvalue())
+        os.close(w)
+        with os.fdopen(r,'rb') as f:
+            self.assertEqual(self.run_file(f),(3,"42"))
+
+class SemanticsTest(unittest.TestCase):
+    # every instruction of MIPS_SEMANTICS and MIPS_BRANCHES is run on
+    # boundary operands and compared to REFERENCE
+
+    def setUp(self):
+        self.sim = pymips.Simulator(pymips.assemble(".text\nnop\n"))
+        self.r = self.sim.registers
+
+    def run_instr(self,parts,t=0,u=0,d=0):
+        # run one instruction with $t0 = t, $t1 = u and $v0 = d
+        r = self.r
+        r[:] = [0] * pymips.REG_COUNT
+        r[8], r[9], r[2] = t, u, d
+        return self.sim.decode(parts)(0)
+
+    def check(self,name,parts,t,u,expected):
+        msg = "{0} with {1}, {2}".format(name,t,u)
+        if name in ('div','divu','rem') and u == 0:
+            self.assertRaises(ZeroDivisionError,self.run_instr,parts,t,u)
+            return
+        if name in pymips.MIPS_BRANCHES:
+            self.assertEqual(self.run_instr(parts,t,u) == 7,expected(t,u),msg)
+        elif name in ('div','divu','mult','multu'):
+            self.run_instr(parts,t,u)
+            self.assertEqual((self.r[pymips.REG_HI],self.r[pymips.REG_LO]),
+                             tuple(s32(x) for x in expected(t,u)),msg)
+        else:
+            self.run_instr(parts,t,u,t)
+            self.assertEqual(self.r[2],s32(expected(t,u)),msg)
+
+    def test_covered(self):
+        for name in itertools.chain(pymips.MIPS_SEMANTICS,pymips.MIPS_BRANCHES):
+            self.assertTrue(name in REFERENCE or name in MEMORY,name)
+
+    def test_registers(self):
+        for name in ('add','addu','and','mul','mulu','nor','or','rem','sub','subu','xor','slt','sltu'):
+            for t, u in itertools.product(BOUNDARY,BOUNDARY):
+                self.check(name,[name,'$v0','$t0','$t1'],t,u,REFERENCE[name])
+
+    def test_hi_lo(self):
+        for name in ('div','divu','mult','multu'):
+            for t, u in itertools.product(BOUNDARY,BOUNDARY):
+                self.check(name,[name,'$t0','$t1'],t,u,REFERENCE[name])
+
+    def test_immediates(self):
+        for name in ('addi','addiu','andi','ori','xori','slti','sltiu','rem'):
+            for t, u in itertools.product(BOUNDARY,BOUNDARY + LARGE):
+                self.check(name,[name,'$v0','$t0',u],t,u,REFERENCE[name])
+        for name in ('lhi','llo'):
+            for t, u in itertools.product(BOUNDARY,(0,1,0x7fff,0xffff)):
+                self.check(name,[name,'$v0',u],t,u,REFERENCE[name])
+        for name in ('la','li'):
+            for u in BOUNDARY + LARGE:
+                self.check(name,[name,'$v0',u],0,u,REFERENCE[name])
+
+    def test_shifts(self):
+        for name in ('sll','sra','srl'):
+            for t, u in itertools.product(BOUNDARY,SHIFTS):
+                self.check(name,[name,'$v0','$t0',u],t,u,REFERENCE[name])
+                self.check(name,[name,'$v0','$t0','$t1'],t,u,REFERENCE[name])
+        for name in ('sllv','srav','srlv'):
+            for t, u in itertools.product(BOUNDARY,SHIFTS):
+                self.check(name,[name,'$v0','$t0','$t1'],t,u,REFERENCE[name])
+
+    def test_moves(self):
+        r = self.r
+        for t in BOUNDARY:
+            self.check('move',['move','$v0','$t1'],0,t,REFERENCE['move'])
+            r[8] = t
+            for parts in (['mthi','$t0'],['mtlo','$t0'],['mfhi','$v1'],['mflo','$a0'],['nop']):
+                self.assertEqual(self.sim.decode(parts)(0),1)
+            self.assertEqual((r[pymips.REG_HI],r[pymips.REG_LO],r[3],r[4]),(t,t,t,t))
+
+    def test_branches(self):
+        for name in ('beq','bne','blt','bgt'):
+            for t, u in itertools.product(BOUNDARY,BOUNDARY):
+                self.check(name,[name,'$t0','$t1',7],t,u,REFERENCE[name])
+        for name in ('bgez','bgtz','blez'):
+            for t in BOUNDARY:
+                self.check(name,[name,'$t0',7],t,0,REFERENCE[name])
+
+class GoldenTest(unittest.TestCase):
+    # each program in this directory that has a .out file next to it
+    # must write exactly that output given the .in file (if there is
+    # one) as its input, however it is run
+
+    def runs(self,source,data):
+        # yield (mode,simulator,output stream) for each way of running
+        # the program
+        for mode in ('plain','fused','translated','optimized'):
+            out = io.BytesIO()
+            program = pymips.assemble(source,mode == 'optimized')
+            sim = pymips.Simulator(program,stdin=io.BytesIO(data),stdout=out)
+            if mode == 'fused':
+                sim.enable_fusion()
+            elif mode == 'translated':
+                sim.install_translation(pymips.MIPSTranslator(sim.instr).compile())
+            yield mode, sim, out
+
+    def test_golden(self):
+        paths = glob.glob(os.path.join(TEST_DIR,'*.out'))
+        self.assertTrue(paths)
+        for path in paths:
+            with open(path[:-len('.out')] + '.s','rb') as f:
+                source = f.read()
+            with open(path,'rb') as f:
+                expected = f.read()
+            data = ""
+            if os.path.exists(path[:-len('.out')] + '.in'):
+                with open(path[:-len('.out')] + '.in','rb') as f:
+                    data = f.read()
+            for mode, sim, out in self.runs(source,data):
+                self.assertEqual(sim.run(),0,"{0} ({1})".format(path,mode))
+                self.assertEqual(out.getvalue(),expected,"{0} ({1})".format(path,mode))
+
+class OptimizerTest(unittest.TestCase):
+    # a return address is the offset of an instruction, so a program
+    # that computes with one must keep all of its instructions in place
+    RETURN = (".text\nmain:\njal f\nnop\nli $a0, 7\nli $v0, 1\nsyscall\nli $v0, 10\nsyscall\n"
+              "f:\n{0}\naddi $t0, $t0, 1\njr $t0\n")
+
+    def run_program(self,source,optimize):
+        out = io.BytesIO()
+        sim = pymips.Simulator(pymips.assemble(source,optimize),stdin=io.BytesIO(),stdout=out)
+        return sim.run(), out.getvalue()
+
+    def test_return_address(self):
+        for copy in ("move $t0, $ra",
+                     "addi $sp, $sp, -4\nsw $ra, 0($sp)\nlw $t0, 0($sp)\naddi $sp, $sp, 4"):
+            source = self.RETURN.format(copy)
+            self.assertEqual(self.run_program(source,False),(7,"7"))
+            self.assertEqual(self.run_program(source,True),(7,"7"),copy)
+
+    def test_return(self):
+        # saving and restoring '$ra' around a call still allows it
+        source = (".text\nmain:\njal f\nli $v0, 10\nsyscall\n"
+                  "f:\naddi $sp, $sp, -4\nsw $ra, 0($sp)\nnop\nlw $ra, 0($sp)\naddi $sp, $sp, 4\njr $ra\n")
+        program = pymips.assemble(source,True)
+        self.assertEqual(len(program.instr),8)
+        self.assertEqual(self.run_program(source,True),(0,""))
+
+class LimitTest(unittest.TestCase):
+    LOOP = ".text\nli $a0, 120\nli $v0, 11\nloop:\nsyscall\nj loop\n"
+
+    def simulator(self,**limits):
+        self.out, self.err = io.BytesIO(), io.BytesIO()
+        sim = pymips.Simulator(pymips.assemble(self.LOOP),stdin=io.BytesIO(),stdout=self.out,
+                               stderr=self.err)
+        sim.set_limits(**limits)
+        return sim
+
+    def test_instructions(self):
+        sim = self.simulator(maxInstructions=1000)
+        self.assertEqual(sim.run(),pymips.LIMIT_STATUS)
+        self.assertEqual(sim.retired,1000)
+        self.assertEqual(self.out.getvalue(),"x" * 499)
+        self.assertTrue(self.err.getvalue().startswith("pymips: error: instruction limit of 1000 reached"))
+
+    def test_step(self):
+        sim = self.simulator(maxInstructions=10)
+        self.assertIsNone(sim.step(10))
+        self.assertEqual(sim.step(),pymips.LIMIT_STATUS)
+        self.assertEqual(sim.retired,10)
+
+    def test_timeout(self):
+        sim = self.simulator(timeout=0.1)
+        start = time.time()
+        self.assertEqual(sim.run(),pymips.LIMIT_STATUS)
+        self.assertLess(time.time() - start,5)
+        self.assertIn("time limit of 0.1s reached",self.err.getvalue())
+
+    def test_option(self):
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory,'loop.s')
+            with open(source,'wb') as f:
+                f.write(self.LOOP)
+            p = subprocess.Popen([sys.executable,os.path.join(TEST_DIR,'..','pymips.py'),'--one-step',
+                                  '--no-cache','--max-instructions','100',source],
+                                 stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            self.assertEqual((p.returncode,out),(124,"x" * 49))
+            self.assertIn("instruction limit of 100 reached",err)
+        finally:
+            shutil.rmtree(directory)
+
+class ProfileTest(unittest.TestCase):
+    SOURCE = (".text\nli $t0, 5\nloop:\nmove $a0, $t0\nli $v0, 1\nsyscall\naddi $t0, $t0, -1\n"
+              "bgtz $t0, loop\nli $a0, 0\nli $v0, 10\nsyscall\n")
+
+    def check(self,profile):
+        self.assertEqual(profile['instructions'],29)
+        self.assertEqual(dict(profile['opcodes']),{'li':8,'move':5,'syscall':6,'addi':5,'bgtz':5})
+        self.assertEqual([(x['pc'],x['line'],x['count']) for x in profile['pcs'][:2]],[(1,4,5),(2,5,5)])
+        self.assertEqual(profile['pcs'][0]['location'],"loop")
+        self.assertEqual(dict((name,x['calls']) for name, x in profile['syscalls'].items()),
+                         {'print_int':5,'exit':1})
+
+    def test_profile(self):
+        out = io.BytesIO()
+        sim = pymips.Simulator(pymips.assemble(self.SOURCE),stdin=io.BytesIO(),stdout=out)
+        sim.enable_profiling()
+        self.assertEqual(sim.run(),0)
+        self.assertEqual(out.getvalue(),"54321")
+        self.check(sim.profile())
+
+    def test_option(self):
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory,'loop.s')
+            path = os.path.join(directory,'profile.json')
+            with open(source,'wb') as f:
+                f.write(self.SOURCE)
+            p = subprocess.Popen([sys.executable,os.path.join(TEST_DIR,'..','pymips.py'),'--one-step',
+                                  '--no-cache','--profile',path,source],
+                                 stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            self.assertEqual((p.returncode,out),(0,"54321"))
+            self.assertTrue(err.startswith("pymips: profile: 29 instructions retired\n"),err)
+            with open(path) as f:
+                self.check(json.load(f))
+        finally:
+            shutil.rmtree(directory)
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = pymips.MIPSCache(self.directory,150)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def report(self):
+        f = io.BytesIO()
+        self.cache.report(f)
+        return dict(line.split(": ")[1:] for line in f.getvalue().splitlines())
+
+    def test_hit(self):
+        key = self.cache.key("li $a0, 1",False)
+        self.assertNotEqual(key,self.cache.key("li $a0, 1",True))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key,"program")
+        with self.cache.get(key) as f:
+            self.assertEqual(f.read(),"program")
+        report = self.report()
+        self.assertEqual((report['cache hits'],report['cache misses']),("1","1"))
+        self.assertEqual(report['cache entries'],"1")
+
+    def test_evict(self):
+        # the least recently used entry goes first
+        self.cache.put('a',"x"*60)
+        self.cache.put('b',"x"*60)
+        os.utime(self.cache.path('a'),(0,0))
+        os.utime(self.cache.path('b'),(1,1))
+        self.cache.get('a').close()
+        self.cache.put('c',"x"*60)
+        self.assertEqual(sorted(os.path.basename(path) for _, _, path in self.cache.entries()),
+                         ['a.mips','c.mips'])
+
+    def test_counters(self):
+        # the log of lookups is folded into fixed-size counters
+        log = pymips.CACHE_LOG
+        pymips.CACHE_LOG = 4
+        try:
+            for event in "hmhhmhhmh":
+                self.cache.record(event)
+        finally:
+            pymips.CACHE_LOG = log
+        self.assertEqual(os.path.getsize(self.cache.statsfile),1)
+        self.assertEqual(os.path.getsize(self.cache.countsfile),pymips.CACHE_COUNTS.size)
+        self.assertEqual(self.cache.counts(),(5,3))
+        report = self.report()
+        self.assertEqual((report['cache hits'],report['cache misses']),("6","3"))
+        self.assertEqual(self.cache.counts(),(6,3))
+
+class BatchTest(unittest.TestCase):
+    # adds the number it reads to a word in memory that starts at zero
+    SOURCE = (".data\ntotal: .word 0\nprompt: .asciiz \"n? \"\n.text\nla $a0, prompt\nli $v0, 4\n"
+              "syscall\nli $v0, 5\nsyscall\nlw $t0, total\nadd $t0, $t0, $v0\nsw $t0, total\n"
+              "move $a0, $t0\nli $v0, 1\nsyscall\nli $a0, 0\nli $v0, 10\nsyscall\n")
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self,name,content):
+        with open(os.path.join(self.directory,name),'wb') as f:
+            f.write(content)
+
+    def test_snapshot(self):
+        # each run resumes from where the program first asked for input
+        # with the memory it had then
+        out = io.BytesIO()
+        sim = pymips.Simulator(pymips.assemble(self.SOURCE),stdin=None,stdout=out)
+        sim.run_until()
+        state = sim.snapshot()
+        self.assertEqual(out.getvalue(),"n? ")
+        for n in (3,5):
+            out = io.BytesIO()
+            sim.reset(stdin=io.BytesIO("{0}\n".format(n)),stdout=out)
+            sim.restore(state)
+            self.assertEqual(sim.run(),0)
+            self.assertEqual(out.getvalue(),str(n))
+
+    def test_batch(self):
+        f = io.BytesIO()
+        pymips.assemble(self.SOURCE).write(f)
+        self.write('prog.mips',f.getvalue())
+        manifest = []
+        for n, expected in ((3,"n? 3"),(5,"n? 5"),(7,"n? 8")):
+            self.write('in{0}'.format(n),"{0}\n".format(n))
+            self.write('out{0}'.format(n),expected)
+            manifest.append({'program':'prog.mips','input':'in{0}'.format(n),'expected':'out{0}'.format(n)})
+        manifest.append({'program':'prog.mips','status':0})
+        self.write('manifest.json',json.dumps(manifest))
+        for options in ([],['--no-snapshot']):
+            p = subprocess.Popen([sys.executable,os.path.join(TEST_DIR,'..','pymips.py'),'--batch','-j','2',
+                                  os.path.join(self.directory,'manifest.json')] + options,
+                                 stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            self.assertEqual(p.returncode,1,err)
+            summary = json.loads(out)
+            self.assertEqual((summary['total'],summary['passed'],summary['failed']),(4,2,1))
+            self.assertEqual([case['passed'] for case in summary['cases']],[True,True,False,None])
+            self.assertEqual([case['stdout'] for case in summary['cases']],["n? 3","n? 5","n? 7","n? "])
+            self.assertEqual(summary['cases'][3]['status'],1)
+            self.assertIn("unexpected EOF",summary['cases'][3]['stderr'])
+
+class ServeTest(unittest.TestCase):
+    LOOP = ".text\nloop:\nj loop\n"
+    CHATTY = ".text\nloop:\nli $a0, 120\nli $v0, 11\nsyscall\nj loop\n"
+
+    def serve(self,source,**options):
+        # start a host on a free port and connect to it
+        settings = dict(port=0,slice=pymips.SLICE_STEPS,stackSize=pymips.STACK_SPACE,
+                        memorySize=pymips.MEMORY_SIZE,maxInstructions=None,timeout=None,
+                        noFusion=False,translate=False,tiered=False,profile=None)
+        settings.update(options)
+        self.host = pymips.MIPSHost(pymips.assemble(source),argparse.Namespace(**settings))
+        self.client = socket.create_connection(self.host.getsockname())
+        self.poll(lambda: self.host.sessions)
+
+    def poll(self,done,seconds=10):
+        # run the host until 'done' holds
+        deadline = time.time() + seconds
+        while not done():
+            self.assertLess(time.time(),deadline)
+            self.host.poll(0.01)
+
+    def received(self):
+        data = ""
+        while True:
+            chunk = self.client.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+
+    def tearDown(self):
+        for session in self.host.sessions:
+            session.close()
+        self.host.close()
+        self.client.close()
+
+    def test_echo(self):
+        self.serve(".text\nli $v0, 5\nsyscall\nmove $a0, $v0\nli $v0, 1\nsyscall\nli $v0, 10\nsyscall\n")
+        self.client.sendall("42\n")
+        self.poll(lambda: not self.host.sessions)
+        self.assertEqual(self.received(),"42")
+
+    def test_instruction_limit(self):
+        # a session that runs away is stopped by the limits; the other
+        # end has stopped sending but is still waiting for the output
+        self.serve(ServeTest.LOOP,maxInstructions=20000)
+        self.client.shutdown(socket.SHUT_WR)
+        self.poll(lambda: not self.host.sessions)
+        self.assertIn("instruction limit of 20000 reached",self.received())
+
+    def test_timeout(self):
+        self.serve(ServeTest.LOOP,timeout=0.2)
+        self.poll(lambda: not self.host.sessions)
+        self.assertIn("time limit of 0.2s reached",self.received())
+
+    def test_gone(self):
+        # a session that runs away after the other end has gone away is
+        # dropped once its output cannot be sent
+        self.serve(ServeTest.CHATTY)
+        self.host.poll(0)
+        self.client.close()
+        self.poll(lambda: not self.host.sessions)
+
+if __name__ == '__main__':
+    unittest.main()